@@ -0,0 +1,330 @@
+import hashlib
+import io
+import logging
+import os
+import pickle
+import struct
+import threading
+import uuid
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+from pandas.api.types import infer_dtype
+
+from backend.param.settings import store_path, artifact_budget, artifact_compression
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Results of the tasks are kept as files in a content-addressed store instead of as pickled blobs in redis. Redis only
+# keeps the small ArtifactHandle of a result. DataFrames of strings and scalars are written as parquet files, all other
+# results are pickled with protocol 5. The numpy and pandas blocks of a result are written as out-of-band buffers next
+# to the pickle instead of being copied into it, and the pickle and the buffers are compressed with zstd or lz4 if
+# available. When the files exceed the size budget of the store, the least recently used files are removed.
+
+ARTIFACTS_DIR = 'artifacts'
+PARQUET = 'parquet'
+# Pickles of protocol 5 with out-of-band buffers, see encode_frames
+PICKLE5 = 'pickle5'
+# Pickles stored before out-of-band buffers, only loaded
+PICKLE = 'pickle'
+ZSTD = 'zstd'
+LZ4 = 'lz4'
+NONE = 'none'
+# Smaller pickles are not compressed
+MIN_COMPRESS_SIZE = 64 * 1024
+FRAME_MAGIC = b'DTA5'
+# Redis key of the size of the files of the store, see LocalArtifactStore.share_size
+SIZE_KEY = 'artifact-store-size'
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ArtifactHandle:
+    # Hex digest of the sha256 of the file content
+    digest: str
+    format: str
+    size: int
+    # Size of the raw data before the compression, 0 for handles stored before the compression
+    raw_size: int = 0
+
+    @property
+    def name(self) -> str:
+        return f'{self.digest}.{self.format}'
+
+    @property
+    def memory_size(self) -> int:
+        # Estimate of the memory of the decoded data
+        return max(self.raw_size, self.size)
+
+
+class ArtifactStore:
+    # Extension point for other backends of the store, e.g. object storage
+    def put(self, data: Any) -> ArtifactHandle:
+        raise NotImplementedError
+
+    def get(self, handle: ArtifactHandle) -> Optional[Any]:
+        # None if the artifact was evicted
+        raise NotImplementedError
+
+    def exists(self, handle: ArtifactHandle) -> bool:
+        raise NotImplementedError
+
+
+def available_codec(codec: str) -> str:
+    # The given compression if it is installed, otherwise the other one or none
+    installed = {ZSTD: zstandard is not None, LZ4: lz4 is not None}
+    if codec not in installed:
+        return codec
+    if installed[codec]:
+        return codec
+    other = LZ4 if codec == ZSTD else ZSTD
+    return other if installed[other] else NONE
+
+
+# Codecs by type of the results, either PARQUET or the compression of the pickle. Results of other types are pickled
+# with the compression of the settings.
+CODECS_BY_TYPE: Dict[type, str] = {pd.DataFrame: PARQUET}
+
+
+def codec_of(data: Any) -> str:
+    for typ, codec in CODECS_BY_TYPE.items():
+        if isinstance(data, typ):
+            return available_codec(codec)
+    return available_codec(artifact_compression)
+
+
+def compress(frame, codec: str):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(frame)
+    if codec == LZ4:
+        return lz4.frame.compress(frame)
+    return frame
+
+
+def decompress(frame, codec: str):
+    if codec == ZSTD:
+        return zstandard.ZstdDecompressor().decompress(frame)
+    if codec == LZ4:
+        return lz4.frame.decompress(frame)
+    return frame
+
+
+def encode_frames(data: Any, codec: str) -> Tuple[bytes, int]:
+    # The content is the magic, the compression, the number and the lengths of the frames followed by the frames. The
+    # first frame is the pickle, the others are its out-of-band buffers. Also returns the size of the raw frames.
+    buffers = []
+    frames = [memoryview(pickle.dumps(data, protocol=5, buffer_callback=buffers.append))]
+    frames += [buffer.raw() for buffer in buffers]
+    raw_size = sum(len(frame) for frame in frames)
+    if raw_size < MIN_COMPRESS_SIZE:
+        codec = NONE
+    frames = [compress(frame, codec) for frame in frames]
+    header = FRAME_MAGIC + codec.encode('ascii').ljust(4) + struct.pack(f'<I{len(frames)}Q', len(frames),
+                                                                       *[len(frame) for frame in frames])
+    return b''.join([header] + frames), raw_size
+
+
+def decode_frames(content: bytearray) -> Tuple[Any, str, int]:
+    # Returns the data, the compression and the size of the raw frames
+    if content[:4] != FRAME_MAGIC:
+        raise ValueError('Content does not start with the magic of pickle frames')
+    codec = bytes(content[4:8]).decode('ascii').strip()
+    n_frames, = struct.unpack_from('<I', content, 8)
+    start = 12 + 8 * n_frames
+    view = memoryview(content)
+    frames = []
+    for length in struct.unpack_from(f'<{n_frames}Q', content, 12):
+        frame = view[start:start + length]
+        # Uncompressed buffers are slices of the content, decompressed ones are copied to keep the arrays writable
+        frames.append(frame if codec == NONE else bytearray(decompress(frame, codec)))
+        start += length
+    return pickle.loads(frames[0], buffers=frames[1:]), codec, sum(len(frame) for frame in frames)
+
+
+class CodecMetrics:
+    # Sizes and times of the encoded and decoded artifacts by codec, per process
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals: Dict[str, Dict[str, float]] = {}
+
+    def record(self, codec: str, operation: str, raw_size: int, stored_size: int, seconds: float) -> None:
+        with self._lock:
+            totals = self.totals.setdefault(f'{codec}:{operation}',
+                                            {'count': 0, 'raw_bytes': 0, 'stored_bytes': 0, 'seconds': 0.0})
+            totals['count'] += 1
+            totals['raw_bytes'] += raw_size
+            totals['stored_bytes'] += stored_size
+            totals['seconds'] += seconds
+        logger.info('%s %s: %d raw bytes, %d stored bytes, ratio %.2f, %.3f s, %.1f MB/s', operation, codec,
+                    raw_size, stored_size, raw_size / max(stored_size, 1), seconds, raw_size / max(seconds, 1e-9) / 1e6)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {key: {**totals,
+                          'ratio': totals['raw_bytes'] / max(totals['stored_bytes'], 1),
+                          'throughput': totals['raw_bytes'] / max(totals['seconds'], 1e-9)}
+                    for key, totals in self.totals.items()}
+
+
+codec_metrics = CodecMetrics()
+
+
+def parquet_compatible(df: pd.DataFrame) -> bool:
+    # Parquet keeps object columns only if they hold strings, lists and sets would be read back as numpy arrays
+    columns = [df.index.to_series()] + [df.iloc[:, i] for i in range(df.shape[1])]
+    return all(col.dtype != object or infer_dtype(col, skipna=True) in ('string', 'empty') for col in columns)
+
+
+def encode(data: Any) -> Tuple[bytes, str, int]:
+    # Returns the content, the format and the size of the raw data
+    started = perf_counter()
+    codec = codec_of(data)
+    if codec == PARQUET and not parquet_compatible(data):
+        codec = available_codec(artifact_compression)
+    if codec == PARQUET:
+        try:
+            buffer = io.BytesIO()
+            data.to_parquet(buffer)
+            content = buffer.getvalue()
+            raw_size = int(data.memory_usage().sum())
+            codec_metrics.record(PARQUET, 'encode', raw_size, len(content), perf_counter() - started)
+            return content, PARQUET, raw_size
+        except (ValueError, TypeError, NotImplementedError, ImportError):
+            # Frames parquet cannot write, e.g. of column names that are not strings, are pickled
+            codec = available_codec(artifact_compression)
+    content, raw_size = encode_frames(data, codec)
+    codec_metrics.record(codec, 'encode', raw_size, len(content), perf_counter() - started)
+    return content, PICKLE5, raw_size
+
+
+def decode(content, format: str) -> Any:
+    started = perf_counter()
+    codec, raw_size = format, len(content)
+    if format == PARQUET:
+        data = pd.read_parquet(io.BytesIO(content))
+    elif format == PICKLE5:
+        data, codec, raw_size = decode_frames(content)
+    else:
+        data = pickle.loads(content)
+    codec_metrics.record(codec, 'decode', raw_size, len(content), perf_counter() - started)
+    return data
+
+
+class LocalArtifactStore(ArtifactStore):
+    def __init__(self, path: str, budget: int):
+        self.path = path
+        self.budget = budget
+        # Size of the stored files, counted once and updated on every put. It is counted again whenever it exceeds the
+        # budget. Without redis the size is only known to the process, see share_size.
+        self.db = None
+        self._size = None
+        self._lock = threading.Lock()
+
+    def share_size(self, db) -> None:
+        # The size is kept in redis, so that the budget holds for all web and worker processes writing to the store
+        self.db = db
+
+    def file(self, handle: ArtifactHandle) -> str:
+        # Files are spread over subdirectories by the first two characters of their digest
+        return os.path.join(self.path, handle.digest[:2], handle.name)
+
+    def put(self, data: Any) -> ArtifactHandle:
+        content, format, raw_size = encode(data)
+        handle = ArtifactHandle(hashlib.sha256(content).hexdigest(), format, len(content), raw_size)
+        file = self.file(handle)
+        try:
+            # Same content was stored before
+            os.utime(file)
+            return handle
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp_file = f'{file}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_file, file)
+        if self.add_size(len(content)) > self.budget:
+            self.evict(keep=file)
+        return handle
+
+    def get(self, handle: ArtifactHandle) -> Optional[Any]:
+        file = self.file(handle)
+        try:
+            with open(file, 'rb') as f:
+                # Read into a bytearray, the uncompressed buffers of the artifact are used without copies
+                content = bytearray(os.fstat(f.fileno()).st_size)
+                f.readinto(content)
+        except FileNotFoundError:
+            return None
+        try:
+            # The modification time is the time of the last use
+            os.utime(file)
+        except FileNotFoundError:
+            pass
+        return decode(content, handle.format)
+
+    def exists(self, handle: ArtifactHandle) -> bool:
+        return os.path.exists(self.file(handle))
+
+    def add_size(self, size: int) -> int:
+        # Size of the store after a new file of the given size was written
+        if self.db is not None:
+            if not self.db.exists(SIZE_KEY):
+                total = sum(file_size for _, _, file_size in self.files())
+                if self.db.set(SIZE_KEY, total, nx=True):
+                    return total
+            return self.db.incrby(SIZE_KEY, size)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(file_size for _, _, file_size in self.files())
+            else:
+                self._size += size
+            return self._size
+
+    def files(self):
+        # Modification time, path and size of the stored files
+        files = []
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                file = os.path.join(root, name)
+                try:
+                    stat = os.stat(file)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, file, stat.st_size))
+        return files
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        files = self.files()
+        total = sum(size for _, _, size in files)
+        # Least recently used files first
+        for _, file, size in sorted(files):
+            if total <= self.budget:
+                break
+            if file == keep:
+                continue
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            total -= size
+        if self.db is not None:
+            self.db.set(SIZE_KEY, total)
+        else:
+            with self._lock:
+                self._size = total
+
+
+artifact_store: ArtifactStore = LocalArtifactStore(os.path.join(store_path, ARTIFACTS_DIR), artifact_budget)
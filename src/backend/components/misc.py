@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 import dash_html_components as html
@@ -255,3 +257,34 @@ def show_button_id(title):
 
 def show_title_maker(title):
     return title.title()
+
+
+def progress_id(title):
+    return title + '-progress'
+
+
+def progress_interval_id(title):
+    return title + '-progress-interval'
+
+
+def progress_panel(title, interval=2000):
+    # Polled by the progress callback of the page
+    return html.Div(
+        [
+            dcc.Interval(id=progress_interval_id(title), interval=interval, n_intervals=0),
+            html.Div(id=progress_id(title))
+        ]
+    )
+
+
+def progress_display(progress):
+    # Progress by task type of the unfinished tasks, see backend.progress.tracked_progress
+    rows = []
+    for task_type, current in progress.items():
+        items = f' ({current["done"]} / {current["total"]})' if current['total'] else ''
+        rows.append(html.Div(
+            f'{task_type}: {current["stage"]}{items}, '
+            f'{timedelta(seconds=int(current["stage_elapsed"]))} in stage, '
+            f'{timedelta(seconds=int(current["elapsed"]))} in total, '
+            f'last report {int(current["idle"])} s ago'))
+    return rows
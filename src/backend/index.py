@@ -169,6 +169,8 @@ if __name__ == '__main__':
         app.run_server(
             debug=debug,
             port=8050,
+            # Callbacks waiting for a task must not block the callbacks of other users
+            threaded=True,
             dev_tools_hot_reload=False, use_reloader=False
         )
     else:
@@ -176,5 +178,6 @@ if __name__ == '__main__':
             host='0.0.0.0',
             debug=debug,
             port=8050,
+            threaded=True,
             dev_tools_hot_reload=True, use_reloader=False
         )
@@ -0,0 +1,153 @@
+import json
+import os
+import shutil
+import uuid
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype, union_categoricals
+
+from backend.param.settings import store_path
+
+# Chunked ingestion of csv and mdl uploads. The upload is read in chunks of CHUNK_ROWS rows and every chunk is written
+# as one parquet file to the table directory of the log hash, so that neither the whole decoded upload nor the whole
+# DataFrame has to be kept in memory or pickled to redis. The dtypes of the columns are inferred in a first pass over
+# the chunks and passed explicitly to the second pass, so that all chunks share the dtypes of a single read_csv.
+#
+# Raw uploads are written once by the web process to the uploads directory of the store, the tasks get the UploadFile
+# and read the upload from the file instead of getting it as a task argument through the broker.
+
+CHUNK_ROWS = 100000
+TABLES_DIR = 'tables'
+UPLOADS_DIR = 'uploads'
+SCHEMA_FILE = 'schema.json'
+CHUNK_FILE = 'part-{:05d}.parquet'
+
+
+@dataclass(frozen=True)
+class UploadFile:
+    path: str
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+
+def store_upload(data: bytes, log_hash: str) -> UploadFile:
+    # Every upload gets its own file, the task reading it removes it, see remove_upload
+    path = os.path.join(store_path, UPLOADS_DIR, f'{log_hash}.{uuid.uuid4().hex}')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return UploadFile(path)
+
+
+def remove_upload(upload: UploadFile) -> None:
+    try:
+        os.remove(upload.path)
+    except FileNotFoundError:
+        pass
+
+
+def table_path(log_hash: str) -> str:
+    return os.path.join(store_path, TABLES_DIR, log_hash)
+
+
+def has_table(log_hash: str) -> bool:
+    return os.path.exists(os.path.join(table_path(log_hash), SCHEMA_FILE))
+
+
+def merge_dtype(first: np.dtype, second: np.dtype) -> np.dtype:
+    # Dtype of a column whose chunks were inferred as first and second
+    if first == second:
+        return first
+    if is_numeric_dtype(first) and is_numeric_dtype(second) and not is_bool_dtype(first) and not is_bool_dtype(second):
+        return np.dtype('float64')
+    return np.dtype('object')
+
+
+def infer_dtypes(stream: BinaryIO, chunk_rows: int) -> Dict[str, np.dtype]:
+    dtypes = {}
+    for chunk in pd.read_csv(stream, chunksize=chunk_rows):
+        for col, dtype in chunk.dtypes.items():
+            dtypes[col] = merge_dtype(dtypes[col], dtype) if col in dtypes else dtype
+    return dtypes
+
+
+def ingest_csv(stream: BinaryIO, log_hash: str, chunk_rows=CHUNK_ROWS) -> pd.DataFrame:
+    # Writes the table of the upload and returns its first chunk, e.g. as preview of the upload
+    dtypes = infer_dtypes(stream, chunk_rows)
+    stream.seek(0)
+    path = table_path(log_hash)
+    # Chunks are written to a temporary directory first, a table is either complete or missing
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp_path)
+    first = None
+    n_rows = 0
+    n_chunks = 0
+    try:
+        for chunk in pd.read_csv(stream, chunksize=chunk_rows, dtype=dtypes):
+            chunk.to_parquet(os.path.join(tmp_path, CHUNK_FILE.format(n_chunks)), index=False)
+            if first is None:
+                first = chunk
+            n_rows += len(chunk)
+            n_chunks += 1
+        schema = {'columns': list(dtypes),
+                  'dtypes': {col: str(dtype) for col, dtype in dtypes.items()},
+                  'rows': n_rows,
+                  'chunks': n_chunks}
+        with open(os.path.join(tmp_path, SCHEMA_FILE), 'w') as f:
+            json.dump(schema, f)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # The same upload was ingested in the meantime, the table in use by its readers is kept
+            if not has_table(log_hash):
+                raise
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return first if first is not None else pd.DataFrame(columns=list(dtypes))
+
+
+def read_schema(log_hash: str) -> Dict:
+    with open(os.path.join(table_path(log_hash), SCHEMA_FILE)) as f:
+        return json.load(f)
+
+
+def iter_table(log_hash: str, columns: Optional[List[str]] = None,
+               categorical: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    path = table_path(log_hash)
+    categorical = categorical if categorical is not None else []
+    for i in range(read_schema(log_hash)['chunks']):
+        chunk = pd.read_parquet(os.path.join(path, CHUNK_FILE.format(i)), columns=columns)
+        for col in categorical:
+            if col in chunk.columns:
+                chunk[col] = chunk[col].astype('category')
+        yield chunk
+
+
+def read_table(log_hash: str, columns: Optional[List[str]] = None,
+               categorical: Optional[List[str]] = None) -> pd.DataFrame:
+    # Activity and object columns are read as categoricals, their values repeat across the whole log
+    chunks = list(iter_table(log_hash, columns, categorical))
+    if len(chunks) == 0:
+        schema = read_schema(log_hash)
+        return pd.DataFrame(columns=columns if columns is not None else schema['columns'])
+    if len(chunks) == 1:
+        return chunks[0]
+    categorical = [col for col in (categorical or []) if col in chunks[0].columns]
+    merged = {col: union_categoricals([chunk[col] for chunk in chunks]) for col in categorical}
+    df = pd.concat([chunk.drop(columns=categorical) for chunk in chunks], ignore_index=True)
+    for col in categorical:
+        df[col] = merged[col]
+    return df[list(chunks[0].columns)]
+
+
+def remove_table(log_hash: str) -> None:
+    shutil.rmtree(table_path(log_hash), ignore_errors=True)
@@ -0,0 +1,62 @@
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from dtween.available.available import DefaultDiagnostics
+from dtween.util.util import DIAGNOSTICS_NAME_MAP, PERFORMANCE_AGGREGATION_NAME_MAP
+
+# Results of analyze_opera are shared by all users and sessions. A result is keyed by the structure of the OCPN, the
+# content hash of the parsed log, the selected measures and the time window. It is always computed for all aggregations,
+# the records of a selection of aggregations are then taken from it, so that changing the aggregations does not replay
+# the log again.
+
+ALL_AGGREGATIONS = list(PERFORMANCE_AGGREGATION_NAME_MAP.values())
+# Measures whose records are kept per object type
+OBJECT_TYPE_MEASURES = ['object_count', 'pooling_time', 'lagging_time']
+AGGREGATED_MEASURES = ['waiting_time', 'service_time', 'sojourn_time', 'synchronization_time', 'flow_time']
+
+
+def default_parameters() -> Dict[str, Any]:
+    # Default measures and all aggregations as in the performance analysis page
+    return {'measures': [DIAGNOSTICS_NAME_MAP[d.value] for d in DefaultDiagnostics],
+            'agg': list(ALL_AGGREGATIONS)}
+
+
+def ocpn_digest(ocpn) -> str:
+    # Independent of the order of the sets of the net and of the process that discovered it
+    places = sorted((pl.name, pl.object_type, pl.initial, pl.final) for pl in ocpn.places)
+    transitions = sorted((tr.name, str(tr.label), tr.silent) for tr in ocpn.transitions)
+    arcs = sorted((arc.source.name, arc.target.name, arc.variable, arc.weight) for arc in ocpn.arcs)
+    return hashlib.sha256(repr((places, transitions, arcs)).encode('utf-8')).hexdigest()
+
+
+def opera_key(ocpn, log_key: str, parameters: Dict[str, Any], window: Optional[Tuple] = None) -> str:
+    measures = sorted(set(parameters['measures']))
+    # Analyses of the whole log keep the keys they had before windows
+    content = (ocpn_digest(ocpn), log_key, measures) if window is None else \
+        (ocpn_digest(ocpn), log_key, measures, window)
+    return 'opera-' + hashlib.sha256(repr(content).encode('utf-8')).hexdigest()
+
+
+def all_aggregations(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    return {**parameters, 'agg': list(ALL_AGGREGATIONS)}
+
+
+def select_aggregations(diagnostics: Dict[str, Any], aggs: List[str]) -> Dict[str, Any]:
+    # Diagnostics of the given aggregations out of the diagnostics of all aggregations
+    def select(record):
+        return {agg: record[agg] for agg in aggs if agg in record}
+
+    selected = {}
+    for name, diag in diagnostics.items():
+        if name == 'arc_freq':
+            selected[name] = diag
+            continue
+        selected[name] = {}
+        for measure, record in diag.items():
+            if measure in OBJECT_TYPE_MEASURES:
+                selected[name][measure] = {ot: select(ot_record) for ot, ot_record in record.items()}
+            elif measure in AGGREGATED_MEASURES:
+                selected[name][measure] = select(record)
+            else:
+                selected[name][measure] = record
+    return selected
@@ -492,13 +492,12 @@ def callback_set_default_config(n_default, n_add, n_action, next_sim_count, acti
             sublog = event_df
             if len(sublog) == 0:
                 print("no events")
-            dt.marking = oper_factory.apply(dt.ocpn, sublog, dt.marking)
+            dt.marking = oper_factory.apply(
+                dt.ocpn, sublog, dt.marking, variant=oper_factory.VECTORIZED_PROJECTION)
             token_map = {}
-            for pl, oi in dt.marking.tokens:
-                if pl.name not in token_map.keys():
-                    token_map[pl.name] = [oi]
-                else:
-                    token_map[pl.name].append(oi)
+            for pl in dt.marking.places:
+                token_map.setdefault(pl.name, []).extend(
+                    dt.marking.objects_in(pl))
             operation_table_columns = [{"name": i, "id": i}
                                        for i in sublog.columns]
             operation_table_data = sublog.to_dict('records')
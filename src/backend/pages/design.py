@@ -3,9 +3,8 @@ from backend.param.settings import CeleryConfig, redis_pwd
 from time import sleep
 import redis
 import pickle
-from ocpa.objects.log.converter import factory as ocel_converter_factory
 from dtween.available.available import AvailableTasks
-from backend.tasks.tasks import get_remote_data, discover_ocpn, store_redis_backend
+from backend.tasks.tasks import get_remote_data, get_remote_ref, discover_ocpn, store_redis_backend, db
 from backend.util import run_task, read_global_signal_value, no_update, parse_contents, transform_to_valves, transform_to_writes, transform_to_activity_variants
 
 from ocpa.visualization.oc_petri_net import factory as ocpn_vis_factory
@@ -13,7 +12,9 @@ import hashlib
 import base64
 
 
-from backend.components.misc import container, button, show_title_maker, show_button_id, temp_jobs_store_id_maker, global_form_load_signal_id_maker
+from backend.components.misc import container, button, show_title_maker, show_button_id, temp_jobs_store_id_maker, global_form_load_signal_id_maker, \
+    progress_panel, progress_id, progress_interval_id, progress_display
+from backend.progress import tracked_progress
 import dash_interactive_graphviz
 from dash.dependencies import Input, Output, State, MATCH
 import dash_html_components as html
@@ -175,11 +176,25 @@ design_content = dbc.Row(
 page_layout = container('Discover Object-Centric Petri Nets',
                         [
                             buttons,
+                            progress_panel(DESIGN_TITLE),
                             design_content
                         ]
                         )
 
 
+@app.callback(
+    Output(progress_id(DESIGN_TITLE), 'children'),
+    Input(progress_interval_id(DESIGN_TITLE), 'n_intervals'),
+    State(global_form_load_signal_id_maker(GLOBAL_FORM_SIGNAL), 'children')
+)
+def show_design_progress(n, value):
+    if value is None:
+        return dash.no_update
+    log_hash, date = read_global_signal_value(value)
+    user = request.authorization['username']
+    return progress_display(tracked_progress(db, user, log_hash))
+
+
 @ app.callback(
     Output("gv", "dot_source"),
     Output("gv", "engine"),
@@ -219,12 +234,11 @@ def run_discover_ocpn(n_discover, value, data_jobs):
         if button_id == show_button_id(discover_title):
             log_hash, date = read_global_signal_value(value)
             user = request.authorization['username']
-            data = get_remote_data(user, log_hash, data_jobs,
-                                   AvailableTasks.PARSE.value)
-            eve_df, obj_df = ocel_converter_factory.apply(
-                data, variant='json_to_mdl')
+            # The parsed log is only loaded and converted by the worker
+            data = get_remote_ref(user, log_hash, data_jobs,
+                                  AvailableTasks.PARSE.value)
             task_id = run_task(
-                data_jobs, log_hash, AvailableTasks.DESIGN.value, discover_ocpn, data=eve_df)
+                data_jobs, log_hash, AvailableTasks.DESIGN.value, discover_ocpn, data=data)
             ocpn = get_remote_data(user, log_hash, data_jobs,
                                    AvailableTasks.DESIGN.value)
             gviz = ocpn_vis_factory.apply(ocpn, parameters={"format": "svg"})
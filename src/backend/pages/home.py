@@ -1,10 +1,10 @@
-import base64
 import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
 import hashlib
 import uuid
+from functools import partial
 
 from backend.app import app
 from backend.components.misc import container, collapse_button_id, button, single_row, \
@@ -16,12 +16,16 @@ from backend.components.userforms import form_dropdown_row, make_job_option, emp
     radio_item_id_maker, radio_items, create_attribute_forms, attribute_form_id
 from backend.param.constants import CSV, JSON, DEFAULT_JOBS, CSV_ATTRIBUTES_FST, NA, \
     JOBS_KEY, JOB_DATA_DATE_KEY, JOB_DATA_NAME_KEY, CSV_ATTRIBUTES_FST_MULT, \
-    JOB_DATA_TYPE_KEY, DESIGN_URL, PARSE_TITLE, STORES_SIGNALS, FORMS, GLOBAL_FORM_SIGNAL, DEFAULT_FORM, \
+    JOB_DATA_TYPE_KEY, DESIGN_URL, PERF_ANALYSIS_URL, PARSE_TITLE, STORES_SIGNALS, FORMS, GLOBAL_FORM_SIGNAL, DEFAULT_FORM, \
     ATTRIBUTE_CSV_TEXT, ATTRIBUTE_OCEL_TEXT, SHOW_PREVIEW_ROWS, MDL, CSV_ATTRIBUTES_SND, CSV_ATTRIBUTES_SND_MULT
 from backend.param.styles import LINK_CONTENT_STYLE, CENTER_DASHED_BOX_STYLE, NO_DISPLAY, FONT_STYLE, BUTTON_LEFT_STYLE
-from backend.tasks.tasks import store_redis_backend, parse_data, get_remote_data, db, user_log_key
-from backend.util import add_job, run_task, forget_all_tasks, get_job_id, check_existing_job, \
-    parse_contents, read_active_attribute_form, build_csv_param, write_global_signal_value, get_attribute_form_dict, guarantee_list_input, no_update, build_json_param, \
+from backend.opera_cache import default_parameters
+from backend.ingest import store_upload
+from backend.param.settings import warm_up
+from backend.tasks.tasks import store_redis_backend, parse_data, ingest_upload, get_remote_data, get_remote_ref, db, user_log_key, \
+    start_warm_up, cancel_warm_up
+from backend.util import add_job, run_task, run_pipeline, forget_all_tasks, get_job_id, check_existing_job, \
+    parse_contents, decode_contents, check_contents, read_active_attribute_form, build_csv_param, write_global_signal_value, get_attribute_form_dict, guarantee_list_input, no_update, build_json_param, \
     read_global_signal_value
 from celery.result import AsyncResult
 from dtween.available.available import AvailableTasks, AvailableSelections
@@ -37,6 +41,7 @@ jobs_title = "Variants"
 jobs_title_hidden = "hidden-jobs"
 upload_table_title = 'all rows'
 parse_title = 'parse'
+pipeline_title = 'parse and analyze'
 upload_tab_title = 'upload'
 analysis_tab_title = 'analysis'
 goto_title = 'Discovery'
@@ -72,6 +77,11 @@ default_attribute_layout = [
                                compute_title_maker,
                                compute_button_id,
                                href=DESIGN_URL),
+                        button(pipeline_title,
+                               compute_title_maker,
+                               compute_button_id,
+                               href=PERF_ANALYSIS_URL,
+                               style=BUTTON_LEFT_STYLE),
                         button(goto_title,
                                goto_title_maker,
                                goto_button_id,
@@ -198,8 +208,8 @@ def upload_data(session, content, name, jobs, options, last_job):
                                "or json format.", color="warning")), \
                 dash.no_update, dash.no_update, dash.no_update
         # compute value and send a signal when done
-        content_type, content_string = content.split(',')
-        log_hash = hashlib.md5(base64.b64decode(content_string)).hexdigest()
+        decoded = decode_contents(content)
+        log_hash = hashlib.md5(decoded).hexdigest()
         if jobs is None:
             # Create default jobs dict for empty jobs-store
             jobs = DEFAULT_JOBS
@@ -212,16 +222,17 @@ def upload_data(session, content, name, jobs, options, last_job):
         else:
             # Save new job
             add_job(data_format, date, jobs, log_hash, name)
-            # Parse raw data
-            out, success = parse_contents(content, data_format)
-            if success:
+            # Raw data is parsed by the tasks, csv and mdl in chunks and OCEL json incrementally
+            if check_contents(decoded, data_format):
+                # The upload is written to the store once, the tasks read it from there instead of the broker
+                upload = store_upload(decoded, log_hash)
                 if data_format == CSV or data_format == MDL:
                     task_id = run_task(jobs, log_hash, AvailableTasks.UPLOAD.value,
-                                       store_redis_backend, data=out)
+                                       ingest_upload, upload=upload, log_hash=log_hash)
                 else:
                     json_param = build_json_param(NA)
                     task_id = run_task(jobs, log_hash, AvailableTasks.UPLOAD.value, parse_data,
-                                       data=out,
+                                       data=upload,
                                        data_type=data_format,
                                        parse_param=json_param)
                 # return write_global_signal_value([session, log_hash, data_format, name, str(date)]), \
@@ -398,14 +409,19 @@ def update_home_output(n, value, radio_value, at, jobs, nonactive, active, init,
     Output(temp_jobs_store_id_maker(PARSE_TITLE), 'data'),
     Output(form_persistence_id_maker(PARSE_TITLE), 'data'),
     Input(compute_button_id(parse_title), 'n_clicks'),
+    Input(compute_button_id(pipeline_title), 'n_clicks'),
     State('active-attribute-selection', 'children'),
     State('jobs-store', 'data'),
     # State(temp_jobs_store_id_maker(CORR_TITLE), 'data'),
     State(temp_jobs_store_id_maker(PARSE_TITLE), 'data'),
     State(form_persistence_id_maker(PARSE_TITLE), 'data')
 )
-def run_parse_log(n, children, jobs, temp_jobs, form):
-    if n is not None:
+def run_parse_log(n, n_pipeline, children, jobs, temp_jobs, form):
+    ctx = dash.callback_context
+    if ctx.triggered and ctx.triggered[0]['value'] is not None:
+        button_id = ctx.triggered[0]['prop_id'].split('.')[0]
+        # The pipeline also discovers the net and computes the default OPerA diagnostics on the workers
+        pipeline = button_id == compute_button_id(pipeline_title)
         activity, log_hash, objects, timestamp, values, start_timestamp = read_active_attribute_form(
             children)
         objects = guarantee_list_input(objects)
@@ -416,23 +432,38 @@ def run_parse_log(n, children, jobs, temp_jobs, form):
             activity, objects, timestamp, values, start_timestamp)
         user = request.authorization['username']
         if jobs[JOBS_KEY][log_hash][JOB_DATA_TYPE_KEY] == CSV or jobs[JOBS_KEY][log_hash][JOB_DATA_TYPE_KEY] == MDL:
-            df = get_remote_data(user, log_hash, jobs,
-                                 AvailableTasks.UPLOAD.value)
             csv_param = build_csv_param(
                 activity, objects, timestamp, values, start_timestamp)
-            task_id = run_task(jobs, log_hash, AvailableTasks.PARSE.value, parse_data, temp_jobs,
-                               data=df,
-                               data_type=CSV,
-                               parse_param=csv_param)
+            # The parse task reads the ingested table of the upload
+            data, data_type, parse_param = log_hash, CSV, csv_param
         else:
-            oc_data = get_remote_data(
+            # The parse task loads the uploaded log itself
+            oc_data = get_remote_ref(
                 user, log_hash, jobs, AvailableTasks.UPLOAD.value)
             if oc_data is None:
-                return no_update(3)
+                return no_update(2)
             json_param = build_json_param(start_timestamp)
-            oc_data.vmap_param = json_param
-            task_id = run_task(jobs, log_hash, AvailableTasks.PARSE.value, store_redis_backend, temp_jobs,
-                               data=oc_data)
+            data, data_type, parse_param = oc_data, JSON, json_param
+        if pipeline:
+            cancel_warm_up(user, log_hash)
+            run_pipeline(jobs, log_hash, temp_jobs,
+                         data=data,
+                         data_type=data_type,
+                         parse_param=parse_param,
+                         opera_parameters=default_parameters())
+        elif warm_up:
+            # Parses the log and speculatively prepares the design and performance analysis pages
+            run_pipeline(jobs, log_hash, temp_jobs, partial(start_warm_up, user, log_hash),
+                         data=data,
+                         data_type=data_type,
+                         parse_param=parse_param,
+                         opera_parameters=default_parameters())
+        else:
+            cancel_warm_up(user, log_hash)
+            task_id = run_task(jobs, log_hash, AvailableTasks.PARSE.value, parse_data, temp_jobs,
+                               data=data,
+                               data_type=data_type,
+                               parse_param=parse_param)
         # return write_global_signal_value([log_hash, task_id]), jobs, form
         return jobs, form
     return no_update(2)
@@ -8,7 +8,9 @@ import json
 from ocpa.util.vis_util import human_readable_stat
 import subprocess
 
-from backend.components.misc import container, single_row, button, show_title_maker, show_button_id, global_signal_id_maker, temp_jobs_store_id_maker, global_form_load_signal_id_maker
+from backend.components.misc import container, single_row, button, show_title_maker, show_button_id, global_signal_id_maker, temp_jobs_store_id_maker, global_form_load_signal_id_maker, \
+    progress_panel, progress_id, progress_interval_id, progress_display
+from backend.progress import tracked_progress
 import dash_interactive_graphviz
 from dash.dependencies import Input, Output, State
 import dash_html_components as html
@@ -20,12 +22,13 @@ import dash
 from backend.param.constants import PARSE_TITLE, DESIGN_TITLE, GLOBAL_FORM_SIGNAL, PERF_ANALYSIS_URL, PERF_ANALYSIS_TITLE
 
 
+from dtween.parsedata.objects.timeindex import EVENT_WINDOW, OBJECT_WINDOW
 from dtween.util.util import DIAGNOSTICS_NAME_MAP, PERFORMANCE_AGGREGATION_NAME_MAP, DIAGNOSTICS_VIS_NAME_MAP
 
 from backend import time_utils
 
-from backend.util import run_task, read_global_signal_value, no_update, transform_config_to_datatable_dict, create_3d_plate, create_2d_plate
-from backend.tasks.tasks import get_remote_data, analyze_opera
+from backend.util import run_task, read_global_signal_value, no_update, check_task_type_in_jobs, transform_config_to_datatable_dict, create_3d_plate, create_2d_plate
+from backend.tasks.tasks import get_remote_data, get_remote_ref, get_log_summary, analyze_opera, load_redis, db
 from dtween.available.available import AvailableTasks, AvailableDiagnostics, DefaultDiagnostics, AvailablePerformanceAggregation
 from flask import request
 from dateutil import parser
@@ -100,6 +103,13 @@ diagnostics_date_picker = html.Div([
         end_date=date(2017, 8, 25),
         display_format='YYYY-MM-DD',
     ),
+    dbc.RadioItems(
+        id='window-mode',
+        options=[{'label': 'Events in the period', 'value': EVENT_WINDOW},
+                 {'label': 'Objects active in the period', 'value': OBJECT_WINDOW}],
+        value=EVENT_WINDOW,
+        inline=True
+    ),
     html.Hr(),
     dbc.Col(html.Div(id="selected-marking"), width=12),
 ])
@@ -153,6 +163,7 @@ operational_view_content = dbc.Row(
 page_layout = container('Object-Centric Performance Analysis',
                         [
                             single_row(html.Div(buttons)),
+                            progress_panel(PERF_ANALYSIS_TITLE),
                             html.Hr(),
                             diagnostics_tab_content,
                             html.Hr(),
@@ -161,6 +172,19 @@ page_layout = container('Object-Centric Performance Analysis',
                         )
 
 
+@app.callback(
+    Output(progress_id(PERF_ANALYSIS_TITLE), 'children'),
+    Input(progress_interval_id(PERF_ANALYSIS_TITLE), 'n_intervals'),
+    State(global_form_load_signal_id_maker(GLOBAL_FORM_SIGNAL), 'children')
+)
+def show_perf_progress(n, value):
+    if value is None:
+        return dash.no_update
+    log_hash, date = read_global_signal_value(value)
+    user = request.authorization['username']
+    return progress_display(tracked_progress(db, user, log_hash))
+
+
 @app.callback(
     Output("gv-operational-view", "dot_source"),
     Output("gv-operational-view", "engine"),
@@ -192,8 +216,9 @@ def show_ocpn(pathname, value):
     State('diagnostics-end', 'data'),
     State('diagnostics-checklist', 'value'),
     State('aggregation-checklist', 'value'),
+    State('window-mode', 'value'),
 )
-def load_ocpn(n_load, n_diagnosis, value, data_jobs, design_jobs, perf_jobs, start_date, end_date, diagnostics_list, aggregation_list):
+def load_ocpn(n_load, n_diagnosis, value, data_jobs, design_jobs, perf_jobs, start_date, end_date, diagnostics_list, aggregation_list, window_mode):
     ctx = dash.callback_context
     if not ctx.triggered:
         button_id = 'No clicks yet'
@@ -204,26 +229,49 @@ def load_ocpn(n_load, n_diagnosis, value, data_jobs, design_jobs, perf_jobs, sta
     if button_id == show_button_id(refresh_title):
         user = request.authorization['username']
         log_hash, date = read_global_signal_value(value)
-        data = get_remote_data(user, log_hash, data_jobs,
-                               AvailableTasks.PARSE.value)
-        eve_df, obj_df = ocel_converter_factory.apply(data)
-        min_date = min(eve_df['event_timestamp']).to_pydatetime().date()
-        max_date = max(eve_df['event_timestamp']).to_pydatetime().date()
+        # The time bounds are read from the summary of the parsed log instead of converting the whole log
+        summary = get_log_summary(user, log_hash, data_jobs)
+        if summary is not None and summary.start is not None:
+            min_date = summary.start.date()
+            max_date = summary.end.date()
+        else:
+            data = get_remote_data(user, log_hash, data_jobs,
+                                   AvailableTasks.PARSE.value)
+            eve_df, obj_df = ocel_converter_factory.apply(data)
+            min_date = min(eve_df['event_timestamp']).to_pydatetime().date()
+            max_date = max(eve_df['event_timestamp']).to_pydatetime().date()
+        # Net annotated with the default diagnostics by the pipeline, see run_parse_log
+        rendered = get_remote_data(user, log_hash, data_jobs,
+                                   AvailableTasks.VISUALIZE.value)
+        if rendered is not None:
+            return data_jobs, rendered['dot'], rendered['object_types'], min_date, max_date, max_date, min_date, max_date
         return dash.no_update, dash.no_update, dash.no_update, min_date, max_date, max_date, min_date, max_date
 
     elif button_id == show_button_id(diagnostics_button_title):
         user = request.authorization['username']
         log_hash, date = read_global_signal_value(value)
-        ocel = get_remote_data(user, log_hash, data_jobs,
-                               AvailableTasks.PARSE.value)
+        # The parsed log is only loaded by the worker
+        ocel = get_remote_ref(user, log_hash, data_jobs,
+                              AvailableTasks.PARSE.value)
         # eve_df, obj_df = ocel_converter_factory.apply(data)
         # +1 day to consider the selected end date
         start_date = parser.parse(start_date).date()
         end_date = parser.parse(end_date).date()
         end_date += datetime.timedelta(days=1)
-
-        ocpn = get_remote_data(user, log_hash, design_jobs,
-                               AvailableTasks.DESIGN.value)
+        # Only the events of the period are replayed
+        window = (datetime.datetime.combine(start_date, datetime.time.min),
+                  datetime.datetime.combine(end_date, datetime.time.min),
+                  window_mode)
+
+        # The net discovered on the design page, otherwise the net discovered by the pipeline in the jobs of the log
+        if not check_task_type_in_jobs(design_jobs, log_hash, AvailableTasks.DESIGN.value):
+            design_jobs = data_jobs
+        # The net is waited for once, its reference is passed to the analysis
+        ocpn_ref = get_remote_ref(user, log_hash, design_jobs,
+                                  AvailableTasks.DESIGN.value)
+        ocpn = load_redis(ocpn_ref.key) if ocpn_ref is not None else None
+        if ocpn is None:
+            return no_update(8)
 
         object_types = ocpn.object_types
         # task_id = run_task(
@@ -237,7 +285,8 @@ def load_ocpn(n_load, n_diagnosis, value, data_jobs, design_jobs, perf_jobs, sta
                               for a in aggregation_list]
 
         task_id = run_task(
-            design_jobs, log_hash, AvailableTasks.OPERA.value, analyze_opera, ocpn=ocpn, ocel=ocel, parameters=diag_params)
+            design_jobs, log_hash, AvailableTasks.OPERA.value, analyze_opera, ocpn=ocpn_ref, ocel=ocel, parameters=diag_params,
+            window=window)
         diagnostics = get_remote_data(user, log_hash, design_jobs,
                                       AvailableTasks.OPERA.value)
 
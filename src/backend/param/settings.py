@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,6 +10,26 @@ entity_rabbit = os.getenv('RABBIT_LOCALHOST_OR_DOCKER')
 rabbit_user = os.getenv('RABBITMQ_USER')
 rabbit_pwd = os.getenv('RABBITMQ_PASSWORD')
 redis_pwd = 'apm191!!'
+# Directory of the on-disk stores, shared by the web app and the celery workers
+store_path = os.getenv('DTWEEN_STORE_PATH', os.path.join(tempfile.gettempdir(), 'dtween'))
+# Size budget in bytes of the stored task results, least recently used results are removed first
+artifact_budget = int(os.getenv('DTWEEN_ARTIFACT_BUDGET', 10 * 1024 ** 3))
+# Compression of the stored results that are pickled, zstd, lz4 or none
+artifact_compression = os.getenv('DTWEEN_ARTIFACT_COMPRESSION', 'zstd')
+# Size budget in bytes of the decoded task results cached by each web process
+result_cache_budget = int(os.getenv('DTWEEN_RESULT_CACHE_BUDGET', 2 * 1024 ** 3))
+# Size budget in bytes of the results cached by each worker process, e.g. for the following stages of a pipeline. Off by
+# default, every process of every worker keeps its own cache.
+worker_result_cache_budget = int(os.getenv('DTWEEN_WORKER_RESULT_CACHE_BUDGET', 0))
+# Whether the net and the default diagnostics are computed in the background after a log is parsed
+warm_up = os.getenv('DTWEEN_WARM_UP', 'false').lower() == 'true'
+
+# Queues of the celery tasks, each queue is served by its own workers, see docker-compose.yml. Quick tasks that only
+# store or render results are not queued behind long analyses.
+QUICK_QUEUE = 'quick'
+PARSE_QUEUE = 'parse'
+DISCOVERY_QUEUE = 'discovery'
+REPLAY_QUEUE = 'replay'
 
 
 class CeleryConfig:
@@ -23,4 +44,18 @@ class CeleryConfig:
     task_serializer = 'pickle'
     worker_prefetch_multiplier = 1
     task_acks_late = True
+    # Tasks of a higher priority are taken from the queue first, 0 is the highest
+    broker_transport_options = {'priority_steps': list(range(10)),
+                                'sep': ':',
+                                'queue_order_strategy': 'priority'}
     imports = ('backend.tasks.tasks',)
+    # The workers import the tasks as module tasks, the web app as backend.tasks.tasks
+    task_routes = {'*.store_redis_backend': {'queue': QUICK_QUEUE},
+                   '*.render_opera': {'queue': QUICK_QUEUE},
+                   '*.ingest_upload': {'queue': PARSE_QUEUE},
+                   '*.parse_data': {'queue': PARSE_QUEUE},
+                   '*.discover_ocpn': {'queue': DISCOVERY_QUEUE},
+                   '*.build_digitaltwin': {'queue': DISCOVERY_QUEUE},
+                   '*.analyze_opera': {'queue': REPLAY_QUEUE},
+                   '*.generate_diagnostics': {'queue': REPLAY_QUEUE}}
+    task_default_queue = QUICK_QUEUE
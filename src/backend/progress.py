@@ -0,0 +1,108 @@
+import json
+from time import time
+from typing import Any, Callable, Dict, Optional
+
+# Progress of the running tasks in small redis hashes. A task reports the stage it is in and the items of the stage it
+# processed so far, the callbacks of the pages poll the hashes of the tasks of the user, see read_progress. The seconds
+# spent in every stage are kept in the hash and in the TIMINGS_KEY list, e.g. for capacity planning.
+
+# The time in seconds the progress of a task is kept
+PROGRESS_TTL = 24 * 3600
+TIMINGS_KEY = 'progress-timings'
+MAX_TIMINGS = 10000
+DONE = 'done'
+FAILED = 'failed'
+
+
+def progress_key(task_id: str) -> str:
+    return f'progress-{task_id}'
+
+
+def tracked_key(user: str, log_hash: str) -> str:
+    return f'tracked-{user}-{log_hash}'
+
+
+class TaskProgress:
+    def __init__(self, db, task_id: str, name: str, on_update: Optional[Callable[[], None]] = None):
+        self.db = db
+        self.key = progress_key(task_id)
+        self.name = name
+        # Called on every report, e.g. to check whether the task was cancelled
+        self.on_update = on_update
+        self.started = time()
+        self.current = None
+        self.stage_started = None
+        self.timings = {}
+        self._write({'task': name, 'started': self.started})
+
+    def stage(self, name: str, total: Optional[int] = None) -> None:
+        now = time()
+        self._close_stage(now)
+        self.current = name
+        self.stage_started = now
+        self._write({'stage': name, 'stage_started': now, 'done': 0, 'total': total if total is not None else ''})
+
+    def update(self, done: int, total: Optional[int] = None) -> None:
+        values = {'done': done}
+        if total is not None:
+            values['total'] = total
+        self._write(values)
+
+    def finish(self) -> None:
+        now = time()
+        self._close_stage(now)
+        self.current = DONE
+        self._write({'stage': DONE, 'stage_started': now})
+        self.db.lpush(TIMINGS_KEY, json.dumps({'task': self.name, 'finished': now, 'stages': self.timings}))
+        self.db.ltrim(TIMINGS_KEY, 0, MAX_TIMINGS - 1)
+
+    def _close_stage(self, now: float) -> None:
+        if self.current is not None:
+            seconds = now - self.stage_started
+            self.timings[self.current] = self.timings.get(self.current, 0) + seconds
+            self.db.hset(self.key, f'time:{self.current}', self.timings[self.current])
+
+    def _write(self, values: Dict[str, Any]) -> None:
+        if self.on_update is not None:
+            self.on_update()
+        self.db.hset(self.key, mapping={**values, 'updated': time()})
+        self.db.expire(self.key, PROGRESS_TTL)
+
+
+def fail_progress(db, task_id: str) -> None:
+    if db.exists(progress_key(task_id)):
+        db.hset(progress_key(task_id), mapping={'stage': FAILED, 'updated': time()})
+
+
+def read_progress(db, task_id: str) -> Optional[Dict[str, Any]]:
+    stored = db.hgetall(progress_key(task_id))
+    if not stored:
+        return None
+    stored = {key.decode('utf-8'): value.decode('utf-8') for key, value in stored.items()}
+    now = time()
+    total = stored.get('total', '')
+    return {'task': stored.get('task'),
+            'stage': stored.get('stage'),
+            'done': int(stored.get('done', 0)),
+            'total': int(total) if total != '' else None,
+            'elapsed': now - float(stored['started']),
+            'stage_elapsed': now - float(stored.get('stage_started', stored['started'])),
+            # Seconds since the last report, tells a slow stage from a stuck one
+            'idle': now - float(stored['updated']),
+            'timings': {key[len('time:'):]: float(value) for key, value in stored.items() if key.startswith('time:')}}
+
+
+def track_tasks(db, user: str, log_hash: str, task_ids: Dict[str, str]) -> None:
+    # Task ids by task type of the tasks started by the user for the log, before the jobs of the pages know them
+    db.hset(tracked_key(user, log_hash), mapping=task_ids)
+    db.expire(tracked_key(user, log_hash), PROGRESS_TTL)
+
+
+def tracked_progress(db, user: str, log_hash: str) -> Dict[str, Dict[str, Any]]:
+    # Progress by task type of the tracked tasks that did not finish yet
+    progress = {}
+    for task_type, task_id in db.hgetall(tracked_key(user, log_hash)).items():
+        current = read_progress(db, task_id.decode('utf-8'))
+        if current is not None and current['stage'] not in (DONE, FAILED):
+            progress[task_type.decode('utf-8')] = current
+    return progress
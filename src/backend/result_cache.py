@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from backend.param.settings import result_cache_budget
+
+# Per process cache of decoded task results. Entries are looked up by the result key together with the handle that is
+# currently stored under the key, a result that was replaced or removed by another process is therefore never served.
+# The size of an entry is estimated by the raw size of its stored artifact.
+
+
+class ResultCache:
+    def __init__(self, budget: int):
+        self.budget = budget
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, handle: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != handle:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, handle: Hashable, data: Any, size: int) -> None:
+        if self.budget <= 0 or size > self.budget:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (handle, data, size)
+            self._size += size
+            self._evict()
+
+    def resize(self, budget: int) -> None:
+        with self._lock:
+            self.budget = budget
+            self._evict()
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def _evict(self) -> None:
+        # Least recently used entries first
+        while self._size > self.budget:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self._size -= evicted
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+
+result_cache = ResultCache(result_cache_budget)
@@ -13,4 +13,5 @@ cd "${dtween_path}/src/backend/"
 chmod +x ./run_celery.sh 
 
 cd "${dtween_path}/src/backend/tasks" || exit
-celery -A tasks worker --loglevel=DEBUG
+# A single worker serving all queues, see CeleryConfig.task_routes
+celery -A tasks worker -Q quick,parse,discovery,replay --loglevel=DEBUG
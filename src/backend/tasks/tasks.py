@@ -1,27 +1,57 @@
-from time import sleep
+import io
+import uuid
+from dataclasses import dataclass
+from time import monotonic
 from typing import Dict, List, Union, Any, Tuple, Optional
 
 import pandas as pd
 import os
 
 
+from backend.artifacts import artifact_store, ArtifactHandle
+from backend.result_cache import result_cache
+from backend.progress import TaskProgress, fail_progress
+from backend.opera_cache import opera_key, all_aggregations, select_aggregations
+from dtween.available.available import AvailableTasks
+from backend.ingest import ingest_csv, read_table, read_schema, has_table, iter_table, remove_table, UploadFile, \
+    remove_upload
 from backend.param.available import AvailableCorrelationsExt, get_available_from_name
-from backend.param.constants import CSV, JOBS_KEY, JOB_TASKS_KEY
-from backend.param.settings import CeleryConfig, redis_pwd
-from celery import Celery
+from backend.param.constants import CSV, JOBS_KEY, JOB_TASKS_KEY, SHOW_PREVIEW_ROWS
+from backend.param.settings import CeleryConfig, redis_pwd, worker_result_cache_budget
+from celery import Celery, chain
+from celery.signals import task_failure, task_revoked, worker_init
+from celery.states import READY_STATES
 from celery.result import AsyncResult
 from dtween.digitaltwin.digitaltwin.objects.factory import get_digital_twin
+from dtween.digitaltwin.digitaltwin.objects.obj import DigitalTwin
+from dtween.parsedata.importer.ocel_json import import_ocel_json as stream_ocel_json
+from dtween.parsedata.objects.timeindex import build_time_index, window_log
+from dtween.parsedata.objects.summary import summarize_log
 from ocpa.objects.log.importer.mdl import factory as mdl_import_factory
+from ocpa.objects.log.converter import factory as ocel_converter_factory
 from ocpa.algo.discovery.ocpn import algorithm as discovery_factory
 from ocpa.algo.conformance.token_based_replay import algorithm as diagnostics_factory
 from ocpa.objects.log.obj import ObjectCentricEventLog
 from ocpa.objects.log.importer.ocel.versions import import_ocel_json
 from ocpa.algo.enhancement.token_replay_based_performance import algorithm as performance_factory
+from ocpa.visualization.oc_petri_net import factory as ocpn_vis_factory
 import pickle
 import redis
 
 # The time in seconds a callback waits for a celery task to get ready
 CELERY_TIMEOUT = 21600
+# Messages published on the result channel of a task, see wait_for_result
+RESULT_READY = b'ready'
+RESULT_FAILED = b'failed'
+# The time in seconds between two checks of the task state while waiting for a notification
+FAILURE_CHECK_INTERVAL = 5
+# Conversion of the parsed log into the event table the net is discovered from
+DISCOVERY_CONVERSION = 'json_to_mdl'
+# Task types of the stages of the pipeline, in the order they run
+PIPELINE_TASKS = [AvailableTasks.PARSE.value, AvailableTasks.DESIGN.value, AvailableTasks.OPERA.value,
+                  AvailableTasks.VISUALIZE.value]
+# Priority of speculative tasks, tasks started by the users have the default priority 0 and are taken first
+WARM_UP_PRIORITY = 9
 
 
 def user_log_key(user, log_hash):
@@ -32,14 +62,112 @@ def results_key(task_id):
     return f'result-{task_id}'
 
 
+def summary_key(task_id):
+    return f'summary-{task_id}'
+
+
+def cancel_key(task_id):
+    return f'cancel-{task_id}'
+
+
+def table_owners_key(log_hash):
+    return f'table-owners-{log_hash}'
+
+
+def table_key(task_id):
+    return f'table-{task_id}'
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+def cancel_task(task_id):
+    # A cancelled task stops at its next check_cancelled, queued tasks are dropped by the workers. Running tasks are not
+    # terminated, the signal could reach the pool process when it already runs another task.
+    db.set(cancel_key(task_id), 1, ex=CELERY_TIMEOUT)
+    celery.control.revoke(task_id)
+
+
+def check_cancelled(task):
+    if db.exists(cancel_key(task.request.id)):
+        raise TaskCancelled(f'Task {task.request.id} was cancelled')
+
+
 def store_redis(data, task):
+    # The result is written to the artifact store, redis only keeps its handle
     key = results_key(task.id)
-    pickled_object = pickle.dumps(data)
-    db.set(key, pickled_object)
+    handle = artifact_store.put(data)
+    db.set(key, pickle.dumps(handle))
+    # Following stages of a pipeline running in the same worker process may reuse the result without decoding it, if
+    # the workers cache results at all, see limit_worker_cache
+    if cacheable(data):
+        result_cache.put(key, handle, data, handle.memory_size)
+    # Wakes up the callbacks waiting for the result
+    db.publish(key, RESULT_READY)
+
+
+def store_artifact(key, data):
+    # Stores data under a key of its inputs instead of a task id, e.g. to share it across tasks
+    db.set(key, pickle.dumps(artifact_store.put(data)))
+
+
+def load_artifact(key):
+    # None if nothing was stored under the key or the artifact was evicted
+    stored = db.get(key)
+    if stored is None:
+        return None
+    return artifact_store.get(pickle.loads(stored))
+
+
+def cacheable(data):
+    # Cached results are shared by all callbacks of the process. Digital twins are changed in place by the callbacks
+    # before they are stored again, they are decoded for every caller instead.
+    return not isinstance(data, DigitalTwin)
+
+
+def load_redis(key):
+    stored = pickle.loads(db.get(key))
+    if isinstance(stored, ArtifactHandle):
+        # Repeated callbacks on the same result reuse the decoded result
+        data = result_cache.get(key, stored)
+        if data is None:
+            data = artifact_store.get(stored)
+            if data is not None and cacheable(data):
+                result_cache.put(key, stored, data, stored.memory_size)
+        return data
+    # Results stored before the artifact store
+    return stored
+
+
+@dataclass(frozen=True)
+class ResultRef:
+    # Reference to the stored result of another task. Tasks take it instead of the result itself, the worker loads the
+    # result from the store, so that large results are not sent back through the broker as arguments.
+    key: str
+
+    @property
+    def digest(self) -> Optional[str]:
+        # Content hash of the result, e.g. to identify the log parsed with the current parameters
+        stored = db.get(self.key)
+        if stored is None:
+            return None
+        handle = pickle.loads(stored)
+        return handle.digest if isinstance(handle, ArtifactHandle) else None
+
+
+def resolve(data):
+    if not isinstance(data, ResultRef):
+        return data
+    resolved = load_redis(data.key) if db.exists(data.key) else None
+    if resolved is None:
+        raise ValueError(f'Result {data.key} is not available anymore')
+    return resolved
 
 
 redis_host = os.getenv('REDIS_LOCALHOST_OR_DOCKER')
 db = redis.StrictRedis(host=redis_host, port=6379, password=redis_pwd, db=0)
+artifact_store.share_size(db)
 
 # db = redis.StrictRedis(host='localhost', port=6379, password=redis_pwd, db=0)
 
@@ -54,6 +182,37 @@ localhost_or_docker = os.getenv('LOCALHOST_OR_DOCKER')
 # celery.conf.update({'CELERY_ACCEPT_CONTENT': ['pickle']})
 
 
+@worker_init.connect
+def limit_worker_cache(**kwargs):
+    # The cache is sized for the web processes, the processes of the workers, forked after this, use their own budget
+    result_cache.resize(worker_result_cache_budget)
+
+
+@task_failure.connect
+def publish_failure(sender=None, task_id=None, exception=None, **kwargs):
+    request = sender.request if sender is not None else None
+    fail_task(task_id, request, exception)
+
+
+@task_revoked.connect
+def publish_revoked(sender=None, request=None, **kwargs):
+    # Cancelled and superseded tasks are revoked, their waiting callbacks are woken up as for failed tasks
+    if request is not None:
+        fail_task(request.id, request, TaskCancelled(f'Task {request.id} was revoked'))
+
+
+def fail_task(task_id, request, exception):
+    fail_progress(db, task_id)
+    db.publish(results_key(task_id), RESULT_FAILED)
+    # The remaining tasks of a failed chain never run, they are failed as well to wake up their waiting callbacks
+    remaining = getattr(request, 'chain', None) if request is not None else None
+    for signature in remaining or []:
+        remaining_id = signature.get('options', {}).get('task_id')
+        if remaining_id is not None:
+            celery.backend.mark_as_failure(remaining_id, exception)
+            db.publish(results_key(remaining_id), RESULT_FAILED)
+
+
 @celery.task(bind=True, serializer='pickle')
 def store_redis_backend(self, data: Any) -> Any:
     store_redis(data, self.request)
@@ -61,14 +220,93 @@ def store_redis_backend(self, data: Any) -> Any:
 
 @celery.task(bind=True, serializer='pickle')
 def parse_data(self, data, data_type, parse_param) -> ObjectCentricEventLog:
+    progress = task_progress(self)
+    progress.stage('load')
+    data = resolve(data)
     # Dirty fix for serialization of parse_param to celery seem to change the values always to False
-    if data_type == CSV:
+    if isinstance(data, ObjectCentricEventLog):
+        # OCEL json that was parsed on upload
+        data.vmap_param = parse_param
+        ocel = data
+    elif data_type == CSV:
+        if isinstance(data, str):
+            # Log hash of an ingested upload
+            data = read_parsed_columns(data, parse_param)
+        progress.stage('parse')
         ocel = mdl_import_factory.apply(
             data, variant="to_obj", parameters=parse_param)
-        store_redis(ocel, self.request)
+    elif isinstance(data, dict):
+        progress.stage('parse')
+        ocel = import_ocel_json.parse_json(data)
+    elif isinstance(data, UploadFile):
+        # The raw OCEL json document is streamed from the upload file, the progress counts bytes
+        progress.stage('parse', total=data.size)
+        try:
+            with open(data.path, 'rb') as f:
+                ocel = stream_ocel_json(f, progress=progress.update)
+        finally:
+            remove_upload(data)
     else:
-        store_redis(import_ocel_json.parse_json(
-            data), self.request)
+        # Raw OCEL json document passed as bytes
+        progress.stage('parse', total=len(data))
+        ocel = stream_ocel_json(io.BytesIO(data), progress=progress.update)
+    progress.stage('summarize')
+    # Stored before the log, the summary exists once the result of the task is ready
+    store_artifact(summary_key(self.request.id), summarize_log(ocel))
+    progress.stage('store')
+    store_redis(ocel, self.request)
+    progress.finish()
+
+
+def task_progress(task):
+    # Every report of the progress also checks whether the task was cancelled
+    return TaskProgress(db, task.request.id, task.name.split('.')[-1], on_update=lambda: check_cancelled(task))
+
+
+def read_parsed_columns(log_hash, parse_param):
+    # Only the selected columns are read, activities and object ids as categoricals
+    columns = read_schema(log_hash)['columns']
+    selected = [parse_param['act_name'], parse_param['time_name']] + \
+        list(parse_param['obj_names']) + list(parse_param['val_names'])
+    if parse_param.get('start_timestamp') in columns:
+        selected.append(parse_param['start_timestamp'])
+    return read_table(log_hash,
+                      columns=[col for col in columns if col in selected],
+                      categorical=[parse_param['act_name']] + list(parse_param['obj_names']))
+
+
+@celery.task(bind=True, serializer='pickle')
+def ingest_upload(self, upload, log_hash):
+    # The table of the upload is written to the store, redis only keeps the preview of the upload. Tables are keyed by the
+    # hash of the upload, the same upload is not ingested twice
+    claim_table(log_hash, self.request.id)
+    try:
+        if has_table(log_hash):
+            preview = next(iter_table(log_hash), pd.DataFrame(columns=read_schema(log_hash)['columns']))
+        else:
+            with open(upload.path, 'rb') as f:
+                preview = ingest_csv(f, log_hash)
+    finally:
+        remove_upload(upload)
+    store_redis(preview[:SHOW_PREVIEW_ROWS], self.request)
+
+
+def claim_table(log_hash, task_id):
+    # Tables are shared by the uploads of the same content of all users, the upload tasks owning a table are kept in
+    # redis and the table is removed when the last of them is forgotten, see release_table
+    db.sadd(table_owners_key(log_hash), task_id)
+    db.set(table_key(task_id), log_hash)
+
+
+def release_table(task_id):
+    log_hash = db.get(table_key(task_id))
+    if log_hash is None:
+        return
+    log_hash = log_hash.decode()
+    db.delete(table_key(task_id))
+    db.srem(table_owners_key(log_hash), task_id)
+    if db.scard(table_owners_key(log_hash)) == 0:
+        remove_table(log_hash)
 
 
 @celery.task(bind=True, serializer='pickle')
@@ -82,15 +320,88 @@ def build_digitaltwin(self, data):
 
 @celery.task(bind=True, serializer='pickle')
 def discover_ocpn(self, data):
-    ocpn = discovery_factory.apply(data)
+    progress = task_progress(self)
+    log_key = data.digest if isinstance(data, ResultRef) else None
+    if log_key is None:
+        progress.stage('load')
+        data = resolve(data)
+        progress.stage('convert')
+        # The parsed log is converted to the event table on the worker
+        eve_df, _ = ocel_converter_factory.apply(data, variant=DISCOVERY_CONVERSION)
+        progress.stage('discover')
+        ocpn = discovery_factory.apply(eve_df)
+    else:
+        # Nets discovered from the same parsed log are shared, e.g. with the speculative discovery after parsing
+        key = discovery_key(log_key)
+        progress.stage('lookup')
+        ocpn = load_artifact(key)
+        if ocpn is None:
+            progress.stage('load')
+            data = resolve(data)
+            progress.stage('convert')
+            eve_df, _ = ocel_converter_factory.apply(data, variant=DISCOVERY_CONVERSION)
+            progress.stage('discover')
+            ocpn = discovery_factory.apply(eve_df)
+            store_artifact(key, ocpn)
+    progress.stage('store')
     store_redis(ocpn, self.request)
+    progress.finish()
+
+
+def discovery_key(log_key):
+    # Keyed by the converted input, the parsed log and its conversion
+    return f'ocpn-{DISCOVERY_CONVERSION}-{log_key}'
 
 
 @celery.task(bind=True, serializer='pickle')
-def analyze_opera(self, ocpn, ocel, parameters):
-    diagnostics = performance_factory.apply(
-        ocpn, ocel, parameters=parameters)
+def analyze_opera(self, ocpn, ocel, parameters, window=None):
+    # The window is the start, the end and the mode of a time window of the log, see window_log
+    progress = task_progress(self)
+    log_key = ocel.digest if isinstance(ocel, ResultRef) else None
+    progress.stage('load')
+    ocpn = resolve(ocpn)
+    if window is not None:
+        progress.stage('index')
+        index = time_index(ocel, log_key)
+        if index.covers(window[0], window[1]):
+            window = None
+    if log_key is None:
+        ocel = resolve(ocel)
+        if window is not None:
+            ocel = window_log(ocel, index, *window)
+        progress.stage('replay')
+        diagnostics = performance_factory.apply(
+            ocpn, ocel, parameters=parameters)
+    else:
+        # Analyses of the same net, log and measures are shared by all users, whatever the selected aggregations
+        key = opera_key(ocpn, log_key, parameters, window)
+        progress.stage('lookup')
+        diagnostics = load_artifact(key)
+        if diagnostics is None:
+            progress.stage('load')
+            ocel = resolve(ocel)
+            if window is not None:
+                ocel = window_log(ocel, index, *window)
+            progress.stage('replay')
+            diagnostics = performance_factory.apply(
+                ocpn, ocel, parameters=all_aggregations(parameters))
+            store_artifact(key, diagnostics)
+        diagnostics = select_aggregations(diagnostics, parameters['agg'])
+    progress.stage('store')
     store_redis(diagnostics, self.request)
+    progress.finish()
+
+
+def time_index(ocel, log_key):
+    # The index of a parsed log is built once and shared by all windows of the log
+    if log_key is None:
+        return build_time_index(resolve(ocel))
+    key = f'time-index-{log_key}'
+    index = load_artifact(key)
+    if index is None:
+        index = build_time_index(resolve(ocel))
+        store_artifact(key, index)
+    return index
 
 
 @celery.task(bind=True, serializer='pickle')
@@ -102,25 +413,75 @@ def generate_diagnostics(self, ocpn, data, start_date=None, end_date=None):
     #     data = data.loc[(data["event_timestamp"] > pd.datetime(start_date))
     #                     & (data["event_timestamp"] < pd.Timestamp(end_date))]
     #     print("Events are filtered: {} - {}".format(start_date, end_date))
+    progress = task_progress(self)
+    progress.stage('load')
+    ocpn, data = resolve(ocpn), resolve(data)
+    progress.stage('replay')
     diagnostics = diagnostics_factory.apply(ocpn, data)
     print("Diagnostics generated: {}".format(diagnostics))
+    progress.stage('store')
     store_redis(diagnostics, self.request)
+    progress.finish()
+
+
+@celery.task(bind=True, serializer='pickle')
+def render_opera(self, ocpn, diagnostics, parameters):
+    # The annotated net is rendered on the worker, the web process only loads the dot source
+    ocpn = resolve(ocpn)
+    gviz = ocpn_vis_factory.apply(
+        ocpn, diagnostics=resolve(diagnostics), variant="annotated_with_opera",
+        parameters={**parameters, 'format': 'svg'})
+    store_redis({'dot': str(gviz), 'object_types': ocpn.object_types}, self.request)
+
+
+def start_pipeline(data, data_type, parse_param, opera_parameters, task_types=PIPELINE_TASKS, priority=None):
+    # Parsing, discovery, OPerA and rendering run as one chain on the workers. The ids of the tasks are assigned up
+    # front, so that every stage refers to the stored results of the previous stages. Only the first stages of the
+    # given task types run, the stages after parsing with the given priority.
+    task_ids = {task_type: str(uuid.uuid4()) for task_type in PIPELINE_TASKS}
+    parsed, ocpn, diagnostics = [ResultRef(results_key(task_ids[task_type])) for task_type in PIPELINE_TASKS[:3]]
+    stages = [parse_data.si(data, data_type, parse_param),
+              discover_ocpn.si(parsed),
+              analyze_opera.si(ocpn, parsed, opera_parameters),
+              render_opera.si(ocpn, diagnostics, opera_parameters)]
+    stages = [stage.set(task_id=task_ids[task_type]) for stage, task_type in zip(stages, task_types)]
+    if priority is not None:
+        stages = [stages[0]] + [stage.set(priority=priority) for stage in stages[1:]]
+    chain(*stages).apply_async()
+    return {task_type: task_ids[task_type] for task_type in task_types}
+
+
+def warm_up_key(user, log_hash):
+    return f'warm-up-{user_log_key(user, log_hash)}'
+
+
+def start_warm_up(user, log_hash, data, data_type, parse_param, opera_parameters):
+    # Parses the log and speculatively discovers the net and computes the default OPerA diagnostics at low priority.
+    # The memoized discovery and analysis then serve the design and performance analysis pages.
+    cancel_warm_up(user, log_hash)
+    task_ids = start_pipeline(data, data_type, parse_param, opera_parameters,
+                              task_types=PIPELINE_TASKS[:3], priority=WARM_UP_PRIORITY)
+    speculative = [task_ids[task_type] for task_type in PIPELINE_TASKS[1:3]]
+    db.set(warm_up_key(user, log_hash), pickle.dumps(speculative))
+    # Only the parsing is a job of the user
+    return {AvailableTasks.PARSE.value: task_ids[AvailableTasks.PARSE.value]}
+
+
+def cancel_warm_up(user, log_hash):
+    # Speculative work is stopped, e.g. when the log is parsed with other parameters
+    stored = db.get(warm_up_key(user, log_hash))
+    if stored is not None:
+        for task_id in pickle.loads(stored):
+            cancel_task(task_id)
+        db.delete(warm_up_key(user, log_hash))
 
 
 def get_remote_data(user, log_hash, jobs, task_type, length=None):
     if jobs is not None and log_hash in jobs[JOBS_KEY] and task_type in jobs[JOBS_KEY][log_hash][JOB_TASKS_KEY]:
-        task = get_task(jobs, log_hash, task_type)
-        task.forget()
-        timeout = 0
-        key = results_key(get_task_id(jobs, log_hash, task_type))
-        while not db.exists(key):
-            sleep(1)
-            timeout += 1
-            if timeout > CELERY_TIMEOUT:
-                return None
-            if task.failed():
-                return None
-        return pickle.loads(db.get(key))
+        ref = get_remote_ref(user, log_hash, jobs, task_type)
+        if ref is None:
+            return None
+        return load_redis(ref.key)
     else:
         if length is not None:
             return tuple([None] * length)
@@ -128,6 +489,49 @@ def get_remote_data(user, log_hash, jobs, task_type, length=None):
             return None
 
 
+def get_remote_ref(user, log_hash, jobs, task_type):
+    # Waits for the result like get_remote_data but only returns its reference, e.g. to pass it to another task
+    if jobs is None or log_hash not in jobs[JOBS_KEY] or task_type not in jobs[JOBS_KEY][log_hash][JOB_TASKS_KEY]:
+        return None
+    task = get_task(jobs, log_hash, task_type)
+    task.forget()
+    key = results_key(get_task_id(jobs, log_hash, task_type))
+    if not wait_for_result(key, task):
+        return None
+    return ResultRef(key)
+
+
+def wait_for_result(key, task, timeout=CELERY_TIMEOUT):
+    # Blocks until the result of the task is stored, instead of polling the key the waiting thread sleeps until the
+    # task publishes on the channel of its result key
+    if db.exists(key):
+        return True
+    pubsub = db.pubsub(ignore_subscribe_messages=True)
+    # Subscribing before checking the key guarantees that a result stored in between is not missed
+    pubsub.subscribe(key)
+    try:
+        deadline = monotonic() + timeout
+        while not db.exists(key):
+            remaining = deadline - monotonic()
+            # Failed and revoked tasks never store their result. A cancelled task is also recognized by its flag, the
+            # state of a task that finished before the wait is forgotten by the callers.
+            if remaining <= 0 or task.state in READY_STATES or db.exists(cancel_key(task.id)):
+                return bool(db.exists(key))
+            message = pubsub.get_message(timeout=min(FAILURE_CHECK_INTERVAL, remaining))
+            if message is not None and message['data'] == RESULT_FAILED:
+                return False
+        return True
+    finally:
+        pubsub.close()
+
+
+def get_log_summary(user, log_hash, jobs):
+    # Summary of the parsed log without loading the log, None for logs parsed before the summaries
+    if get_remote_ref(user, log_hash, jobs, AvailableTasks.PARSE.value) is None:
+        return None
+    return load_artifact(summary_key(get_task_id(jobs, log_hash, AvailableTasks.PARSE.value)))
+
+
 def get_task(jobs, log_hash, task_type):
     task = AsyncResult(id=get_task_id(jobs, log_hash, task_type), app=celery)
     return task
@@ -1,6 +1,7 @@
 import base64
 import io
 import json
+import re
 import ast
 import dash
 from datetime import datetime
@@ -9,8 +10,11 @@ import dash_html_components as html
 import pandas as pd
 from backend.param.constants import JOB_ID_KEY, JOBS_KEY, JOB_DATA_TYPE_KEY, JOB_DATA_NAME_KEY, JOB_DATA_DATE_KEY, \
     JOB_TASKS_KEY, SEP, NA, CSV, PROPS, CHILDREN, VALUE, OBJECTS, TIMESTAMP, VALUES, CORR_METHOD, ACTIVITY, MDL, JSON, START_TIMESTAMP, VALVE_MIN, VALVE_MAX, VALVE_INIT, VALVE_NAME, VALVE_VALUE, WRITE_NAME, WRITE_OBJ_TYPE, WRITE_ATTR_NAME, WRITE_INIT, ACTIVITY_VARIANT_NAME, ACTIVITY_VARIANT_DESC, ACTIVITY_VARIANT_TR_NAME, ACTIVITY_VARIANT_DEFAULT
-from backend.tasks.tasks import celery, get_task, db, results_key
+from backend.result_cache import result_cache
+from backend.progress import track_tasks
+from backend.tasks.tasks import celery, get_task, db, results_key, summary_key, start_pipeline, cancel_task, release_table
 from celery.result import AsyncResult
+from flask import request, has_request_context
 from ocpa.objects.log.util.param import JsonParseParameters
 from dtween.available.constants import INTERVALS, TRANSITION, GUARD
 from typing import List, Set
@@ -67,6 +71,8 @@ def check_most_recent_task(jobs1, jobs2, log_hash):
 
 def run_task(jobs, log_hash, task_type, task, temp_jobs=None, **kwargs):
     task = task.delay(**kwargs)
+    supersede_task(jobs, log_hash, task_type, task.id)
+    track_user_tasks(log_hash, {task_type: task.id})
     if temp_jobs is not None and log_hash in jobs[JOBS_KEY] and task_type in jobs[JOBS_KEY][log_hash][JOB_TASKS_KEY] and jobs[JOBS_KEY][log_hash][JOB_TASKS_KEY][task_type] is not None:
         check_forget_task(task.id, temp_jobs, log_hash, task_type)
     remove_tasks_in_jobs(jobs, log_hash)
@@ -76,6 +82,37 @@ def run_task(jobs, log_hash, task_type, task, temp_jobs=None, **kwargs):
     return task.id
 
 
+def run_pipeline(jobs, log_hash, temp_jobs=None, start=start_pipeline, **kwargs):
+    # Like run_task for the stages of a pipeline, the jobs get the task ids returned by start
+    task_ids = start(**kwargs)
+    track_user_tasks(log_hash, task_ids)
+    for task_type, task_id in task_ids.items():
+        supersede_task(jobs, log_hash, task_type, task_id)
+        if temp_jobs is not None and log_hash in temp_jobs[JOBS_KEY] and task_type in temp_jobs[JOBS_KEY][log_hash][JOB_TASKS_KEY] and temp_jobs[JOBS_KEY][log_hash][JOB_TASKS_KEY][task_type] is not None:
+            check_forget_task(task_id, temp_jobs, log_hash, task_type)
+    remove_tasks_in_jobs(jobs, log_hash)
+    for task_type, task_id in task_ids.items():
+        assign_task_id(jobs, log_hash, task_type, task_id)
+    jobs[JOBS_KEY][log_hash][JOB_TASKS_KEY][JOB_DATA_DATE_KEY] = str(
+        datetime.now())
+    return task_ids
+
+
+def track_user_tasks(log_hash, task_ids):
+    # The progress callbacks of the pages find the tasks while the callback that started them still waits
+    if has_request_context() and request.authorization is not None:
+        track_tasks(db, request.authorization['username'], log_hash, task_ids)
+
+
+def supersede_task(jobs, log_hash, task_type, task_id):
+    # The previous task of the same type for the log is stopped, so that it does not keep a worker busy
+    if jobs is not None and log_hash in jobs[JOBS_KEY]:
+        previous = jobs[JOBS_KEY][log_hash].get(JOB_TASKS_KEY, {}).get(task_type)
+        # The callers forget the states of the tasks, a finished task is recognized by its stored result
+        if previous is not None and previous != task_id and not db.exists(results_key(previous)):
+            cancel_task(previous)
+
+
 def assign_task_id(jobs, log_hash, task_type, task_id):
     jobs[JOBS_KEY][log_hash][JOB_TASKS_KEY][task_type] = task_id
 
@@ -99,8 +136,13 @@ def forget_all_tasks(jobs):
 
 def remove_redis(task_id):
     key = results_key(task_id)
+    result_cache.invalidate(key)
     if db.exists(key):
         db.delete(key)
+    # Summary of a parsed log
+    db.delete(summary_key(task_id))
+    # Table of an upload, if no other upload owns it
+    release_table(task_id)
 
 
 def get_job_id(jobs, log_hash):
@@ -112,6 +154,24 @@ def check_existing_job(jobs, log_hash):
     return log_hash in jobs[JOBS_KEY]
 
 
+def decode_contents(content):
+    # Raw bytes of an upload, e.g. for the streaming OCEL json import
+    content_type, content_string = content.split(',')
+    return base64.b64decode(content_string)
+
+
+def check_contents(decoded, data_format):
+    # Syntactic check of an upload that is parsed by a task, only the beginning of the file is read
+    try:
+        if CSV == data_format or MDL == data_format:
+            pd.read_csv(io.BytesIO(decoded), nrows=1)
+            return True
+        return re.match(rb'\s*{', decoded) is not None
+    except Exception as e:
+        print(e)
+        return False
+
+
 def parse_contents(content, data_format):
     content_type, content_string = content.split(',')
     decoded = base64.b64decode(content_string)
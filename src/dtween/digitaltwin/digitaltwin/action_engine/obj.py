@@ -1,14 +1,12 @@
 from __future__ import annotations
 
+import bisect
 from dataclasses import dataclass
 from typing import Any, List, Set, Tuple, Dict
 from dtween.digitaltwin.digitaltwin.control.obj import Valve, NumericalValve, ActivityVariant
 
 from dtween.digitaltwin.impact_analysis.factory import analyze_pre_impact, analyze_post_impact, analyze_impacted_run_entities, analyze_impacted_conf_entities
-from dtween.available.available import AvailableObjPerformanceMetric, AvailableFuncPerformanceMetric
-from dtween.util.util import REPLAY_DIAGNOSTICS_MAP
-
-from ocpa.algo.enhancement.token_replay_based_performance import algorithm as diagnostics_factory
+from dtween.digitaltwin.digitaltwin.diagnostics.obj import DiagnosticsSnapshot, IncrementalDiagnostics
 
 from typing import TYPE_CHECKING
 
@@ -118,6 +116,8 @@ class ActionInstance(object):
     _pre_action_func_diagnostics = None
     _post_action_obj_diagnostics = None
     _post_action_func_diagnostics = None
+    # Diagnostics at the start, the post diagnostics are taken over the events from the start to the end
+    _pre_action_snapshot = None
 
     def __post_init__(self):
         self.name = self.action.name + \
@@ -129,68 +129,48 @@ class ActionInstance(object):
     def __eq__(self, ai):
         return self.action == ai.action, self.start == ai.start, self.end == ai.end
 
-    def extract_diagnostics(self, diagnostics_data, selected_diagnostics, entities):
-        diagnostics = {}
-        for diag in selected_diagnostics:
-            # for diag in diagnostics_data:
-            replay_diag = selected_diagnostics[diag]
-            if replay_diag in diagnostics_data.keys():
-                # change the name of diagnostics
-                diagnostics[diag] = {}
-                for element in diagnostics_data[replay_diag]:
-                    for entity in entities:
-                        if entity in element:
-                            diagnostics[diag][element] = diagnostics_data[replay_diag][element]
-        print(diagnostics)
-        return diagnostics
-
     @property
     def pre_action_obj_diagnostics(self):
         return self._pre_action_obj_diagnostics
 
     @pre_action_obj_diagnostics.setter
-    def pre_action_obj_diagnostics(self, diagnostics_data):
-        selected_diagnostics = {opm.value: REPLAY_DIAGNOSTICS_MAP[opm.value]
-                                for opm in AvailableObjPerformanceMetric}
-        entities = self.impacted_objects
-        self._pre_action_obj_diagnostics = self.extract_diagnostics(
-            diagnostics_data, selected_diagnostics, entities)
+    def pre_action_obj_diagnostics(self, snapshot: DiagnosticsSnapshot):
+        self._pre_action_snapshot = snapshot
+        self._pre_action_obj_diagnostics = snapshot.object_diagnostics(
+            self.impacted_objects)
 
     @property
     def pre_action_func_diagnostics(self):
         return self._pre_action_func_diagnostics
 
     @pre_action_func_diagnostics.setter
-    def pre_action_func_diagnostics(self, diagnostics_data):
-        selected_diagnostics = {opm.value: REPLAY_DIAGNOSTICS_MAP[opm.value]
-                                for opm in AvailableFuncPerformanceMetric}
-        entities = [tr.name for tr in self.impacted_functions]
-        self._pre_action_func_diagnostics = self.extract_diagnostics(
-            diagnostics_data, selected_diagnostics, entities)
+    def pre_action_func_diagnostics(self, snapshot: DiagnosticsSnapshot):
+        self._pre_action_snapshot = snapshot
+        self._pre_action_func_diagnostics = snapshot.function_diagnostics(
+            [tr.name for tr in self.impacted_functions])
 
     @property
     def post_action_obj_diagnostics(self):
         return self._post_action_obj_diagnostics
 
     @post_action_obj_diagnostics.setter
-    def post_action_obj_diagnostics(self, diagnostics_data):
-        selected_diagnostics = {opm.value: REPLAY_DIAGNOSTICS_MAP[opm.value]
-                                for opm in AvailableObjPerformanceMetric}
-        entities = self.impacted_objects
-        self._post_action_obj_diagnostics = self.extract_diagnostics(
-            diagnostics_data, selected_diagnostics, entities)
+    def post_action_obj_diagnostics(self, snapshot: DiagnosticsSnapshot):
+        self._post_action_obj_diagnostics = self._window(snapshot).object_diagnostics(
+            self.impacted_objects)
 
     @property
     def post_action_func_diagnostics(self):
         return self._post_action_func_diagnostics
 
     @post_action_func_diagnostics.setter
-    def post_action_func_diagnostics(self, diagnostics_data):
-        selected_diagnostics = {opm.value: REPLAY_DIAGNOSTICS_MAP[opm.value]
-                                for opm in AvailableFuncPerformanceMetric}
-        entities = [tr.name for tr in self.impacted_functions]
-        self._post_action_func_diagnostics = self.extract_diagnostics(
-            diagnostics_data, selected_diagnostics, entities)
+    def post_action_func_diagnostics(self, snapshot: DiagnosticsSnapshot):
+        self._post_action_func_diagnostics = self._window(snapshot).function_diagnostics(
+            [tr.name for tr in self.impacted_functions])
+
+    def _window(self, snapshot: DiagnosticsSnapshot) -> DiagnosticsSnapshot:
+        if self._pre_action_snapshot is None:
+            return snapshot
+        return snapshot.since(self._pre_action_snapshot)
 
     def get_obj_impact_diagnostics(self, entity_name, diag_name):
         if diag_name not in self.post_obj_impact:
@@ -207,21 +187,83 @@ class ActionInstance(object):
         return func_impact_diagnostics
 
 
+class ActionSchedule(object):
+    # Names of the action instances sorted by their start and by their end. The instances active at a time are kept
+    # and swept forward to the next time, so that a step only touches the instances starting or ending until then. A
+    # time before the previous one sweeps from the beginning.
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self._count = 0
+        self._time = None
+        self._start_pos = 0
+        self._end_pos = 0
+        self._active = {}
+
+    def add(self, name: str, start: int, end: int) -> None:
+        # The count keeps instances of the same start or end in the order they were added
+        bisect.insort(self._starts, (start, self._count, name))
+        bisect.insort(self._ends, (end, self._count, name))
+        self._count += 1
+        if self._time is None:
+            return
+        if start <= self._time:
+            self._start_pos += 1
+            if end >= self._time:
+                self._active[name] = (start, self._count - 1)
+        if end < self._time:
+            self._end_pos += 1
+
+    def active_at(self, time: int) -> List[str]:
+        if self._time is None or time < self._time:
+            self._start_pos = 0
+            self._end_pos = 0
+            self._active = {}
+        self._time = time
+        while self._start_pos < len(self._starts) and self._starts[self._start_pos][0] <= time:
+            start, count, name = self._starts[self._start_pos]
+            self._active[name] = (start, count)
+            self._start_pos += 1
+        # Instances ending before the time started before it as well
+        while self._end_pos < len(self._ends) and self._ends[self._end_pos][0] < time:
+            self._active.pop(self._ends[self._end_pos][2], None)
+            self._end_pos += 1
+        # In the order of their starts, later instances are applied after earlier ones
+        return sorted(self._active, key=self._active.get)
+
+
 class ActionEngine(object):
     action_repo: Set[Action] = []
     constraint_repo: Set[Constraint]
     action_pattern_repo: Set[Tuple[Set[Constraint], Set[Action]]]
     action_instances: Set[ActionInstance]
 
-    def __init__(self, action_repo=set(), constraint_repo=set(), action_pattern_repo=set(), action_instances=set()):
-        self._action_repo = action_repo
-        self._constraint_repo = constraint_repo
-        self._action_pattern_repo = action_pattern_repo
-        self._action_instances = action_instances
+    def __init__(self, action_repo=None, constraint_repo=None, action_pattern_repo=None, action_instances=None):
+        self._constraint_repo = constraint_repo if constraint_repo is not None else set()
+        self._action_pattern_repo = action_pattern_repo if action_pattern_repo is not None else set()
+        # Actions and action instances by their names
+        self._actions = {}
+        self._instances = {}
+        self._schedule = ActionSchedule()
+        self._diagnostics = IncrementalDiagnostics()
+        for action in action_repo or set():
+            self.add_action(action)
+        for action_instance in action_instances or set():
+            self._add_instance(action_instance)
+
+    def __setstate__(self, state):
+        # Engines stored before the actions were kept by name
+        if "_actions" not in state:
+            action_repo = state.pop("_action_repo")
+            action_instances = state.pop("_action_instances")
+            self.__init__(action_repo, state["_constraint_repo"], state["_action_pattern_repo"], action_instances)
+            return
+        self.__dict__.update(state)
 
     @property
     def action_repo(self):
-        return self._action_repo
+        return set(self._actions.values())
 
     @property
     def constraint_repo(self):
@@ -229,23 +271,37 @@ class ActionEngine(object):
 
     @property
     def action_instances(self):
-        return self._action_instances
+        return set(self._instances.values())
+
+    @property
+    def diagnostics(self) -> IncrementalDiagnostics:
+        return self._diagnostics
 
     def add_action_instance(self, action_name: str, start: int, end: int) -> ActionInstance:
-        for action in self._action_repo:
-            if action_name == action.name:
-                action_instance = ActionInstance(action, start, end)
-                self._action_instances.add(action_instance)
-                print(f'{action_instance} is added to action engine.')
-                return action_instance
-        raise ValueError(
-            f'{action_name} does not exist in the action repository')
+        if action_name not in self._actions:
+            raise ValueError(
+                f'{action_name} does not exist in the action repository')
+        if end < start:
+            raise ValueError(
+                f'{action_name} ends at {end} before it starts at {start}')
+        action_instance = ActionInstance(self._actions[action_name], start, end)
+        self._add_instance(action_instance)
+        print(f'{action_instance} is added to action engine.')
+        return action_instance
+
+    def _add_instance(self, action_instance: ActionInstance) -> None:
+        # An instance of the same action and period replaces the previous one
+        if action_instance.name not in self._instances:
+            self._schedule.add(action_instance.name,
+                               action_instance.start, action_instance.end)
+        self._instances[action_instance.name] = action_instance
 
     def add_constraint(self, constraint):
         self._constraint_repo.add(constraint)
 
     def add_action(self, action):
-        self._action_repo.add(action)
+        # As for the set of actions before, an action of the same name is kept
+        self._actions.setdefault(action.name, action)
 
     def apply_default_configuration(self, valves: Set[Valve], activity_variants: Set[ActivityVariant]):
         for v in valves:
@@ -257,10 +313,7 @@ class ActionEngine(object):
         return valves, activity_variants
 
     def get_action_instance(self, name):
-        for action_instance in self._action_instances:
-            if action_instance.name == name:
-                # if action_name == action_instance.action.name and time >= action_instance.start and time <= action_instance.end:
-                return action_instance
+        return self._instances.get(name)
 
     def apply_action(self, action, valves: Set[Valve], activity_variants: Set[ActivityVariant]):
         for v_action in action.valve_actions:
@@ -285,8 +338,13 @@ class ActionEngine(object):
         dt.valves, dt.activity_variants = self.apply_default_configuration(
             dt.valves, dt.activity_variants)
 
+        self._diagnostics.update(ocel)
         action_instances_at_t = [
-            action_instance for action_instance in self._action_instances if action_instance.start <= time and action_instance.end >= time]
+            self._instances[name] for name in self._schedule.active_at(time)]
+        # Diagnostics of all events streamed so far, shared by the instances starting or ending at the time
+        snapshot = None
+        if any(ai.start == time or ai.end == time for ai in action_instances_at_t):
+            snapshot = self._diagnostics.snapshot()
         for ai in action_instances_at_t:
             if ai.start == time:
                 ai.impacted_objects, ai.impacted_functions = analyze_impacted_conf_entities(
@@ -296,18 +354,16 @@ class ActionEngine(object):
                 ai.pre_impact = analyze_pre_impact(
                     dt, ai)
                 print(f'Pre-impact score: {ai.pre_impact}')
-                # FIXME: conceptually digital twin must contain all diagnostics, but it is infeasible. Thus, we store diagnostics to each action instances as pre and post diagnostics.
-                diagnostics = diagnostics_factory.apply(dt.ocpn, ocel)
-                ai.pre_action_obj_diagnostics = diagnostics
-                ai.pre_action_func_diagnostics = diagnostics
+                ai.pre_action_obj_diagnostics = snapshot
+                ai.pre_action_func_diagnostics = snapshot
 
             elif ai.end == time:
-                diagnostics = diagnostics_factory.apply(dt.ocpn, ocel)
-                ai.post_action_obj_diagnostics = diagnostics
-                ai.post_action_func_diagnostics = diagnostics
+                ai.post_action_obj_diagnostics = snapshot
+                ai.post_action_func_diagnostics = snapshot
                 ai.post_obj_impact, ai.post_func_impact = analyze_post_impact(
                     ai)
             self.apply_action(ai.action, dt.valves, dt.activity_variants)
 
     def clear_action_instances(self):
-        self._action_instances = set()
+        self._instances = {}
+        self._schedule = ActionSchedule()
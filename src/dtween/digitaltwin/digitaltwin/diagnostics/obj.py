@@ -0,0 +1,224 @@
+from dataclasses import dataclass, replace
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from dtween.available.available import AvailableObjPerformanceMetric, AvailableFuncPerformanceMetric
+from dtween.digitaltwin.digitaltwin.util import cell_objects
+
+# Diagnostics of the events streamed into the digital twin, kept as running aggregates per transition and per object
+# type instead of replaying all events seen so far. A snapshot copies the aggregates, which do not grow with the events,
+# so that the diagnostics of the events before an action instance are compared with those of the events during it
+# without replaying the log.
+#
+# Times are in seconds. The waiting time of an event is the time from the last previous event of its objects to its
+# start, the service time the time from its start to its timestamp. The throughput time of an object is the time from
+# its first to its last event, the total service time the sum of the service times of its events. Medians, and minima
+# of the times of objects, change with every event and are not kept.
+
+WAITING = 'waiting'
+SERVICE = 'service'
+SOJOURN = 'sojourn'
+MEASURES = [WAITING, SERVICE, SOJOURN]
+
+FUNCTION_METRICS = {
+    AvailableFuncPerformanceMetric.AVG_SOJOURN_TIME.value: (SOJOURN, 'mean'),
+    AvailableFuncPerformanceMetric.MIN_SOJOURN_TIME.value: (SOJOURN, 'min'),
+    AvailableFuncPerformanceMetric.MAX_SOJOURN_TIME.value: (SOJOURN, 'max'),
+    AvailableFuncPerformanceMetric.AVG_SERVICE_TIME.value: (SERVICE, 'mean'),
+    AvailableFuncPerformanceMetric.MIN_SERVICE_TIME.value: (SERVICE, 'min'),
+    AvailableFuncPerformanceMetric.MAX_SERVICE_TIME.value: (SERVICE, 'max'),
+    AvailableFuncPerformanceMetric.AVG_WAITING_TIME.value: (WAITING, 'mean'),
+    AvailableFuncPerformanceMetric.MIN_WAITING_TIME.value: (WAITING, 'min'),
+    AvailableFuncPerformanceMetric.MAX_WAITING_TIME.value: (WAITING, 'max'),
+    AvailableFuncPerformanceMetric.ACT_FREQ.value: (SERVICE, 'count')
+}
+
+OBJECT_METRICS = {
+    AvailableObjPerformanceMetric.AVG_THROUGHPUT_TIME.value: 'mean_throughput',
+    AvailableObjPerformanceMetric.MAX_THROUGHPUT_TIME.value: 'throughput_max',
+    AvailableObjPerformanceMetric.AVG_TOTAL_SERVICE_TIME.value: 'mean_service',
+    AvailableObjPerformanceMetric.MAX_TOTAL_SERVICE_TIME.value: 'service_max'
+}
+
+
+@dataclass
+class RunningStatistic:
+    count: int = 0
+    total: float = 0.0
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count > 0 else None
+
+    def since(self, previous: 'RunningStatistic') -> 'RunningStatistic':
+        return replace(self, count=self.count - previous.count, total=self.total - previous.total)
+
+
+@dataclass
+class ObjectTypeStatistic:
+    # The times of an object only grow, so the maxima stay valid when they are updated
+    objects: int = 0
+    throughput_total: float = 0.0
+    throughput_max: float = 0.0
+    service_total: float = 0.0
+    service_max: float = 0.0
+
+    def update_throughput(self, old: float, new: float) -> None:
+        self.throughput_total += new - old
+        self.throughput_max = max(self.throughput_max, new)
+
+    def update_service(self, old: float, new: float) -> None:
+        self.service_total += new - old
+        self.service_max = max(self.service_max, new)
+
+    @property
+    def mean_throughput(self) -> Optional[float]:
+        return self.throughput_total / self.objects if self.objects > 0 else None
+
+    @property
+    def mean_service(self) -> Optional[float]:
+        return self.service_total / self.objects if self.objects > 0 else None
+
+    def since(self, previous: 'ObjectTypeStatistic') -> 'ObjectTypeStatistic':
+        # The times added in the window by the objects that appeared in it
+        return replace(self, objects=self.objects - previous.objects,
+                       throughput_total=self.throughput_total - previous.throughput_total,
+                       service_total=self.service_total - previous.service_total)
+
+
+@dataclass
+class DiagnosticsSnapshot:
+    events: int
+    transitions: Dict[str, Dict[str, RunningStatistic]]
+    object_types: Dict[str, ObjectTypeStatistic]
+
+    def since(self, previous: 'DiagnosticsSnapshot') -> 'DiagnosticsSnapshot':
+        # Diagnostics of the events added after the previous snapshot. Counts and means are taken over the window, the
+        # minima and maxima are those of all events.
+        return DiagnosticsSnapshot(
+            events=self.events - previous.events,
+            transitions={tr: {measure: statistic.since(previous.transitions[tr][measure])
+                              if tr in previous.transitions else replace(statistic)
+                              for measure, statistic in statistics.items()}
+                         for tr, statistics in self.transitions.items()},
+            object_types={ot: statistic.since(previous.object_types[ot])
+                          if ot in previous.object_types else replace(statistic)
+                          for ot, statistic in self.object_types.items()})
+
+    def function_diagnostics(self, transitions: Iterable[str]) -> Dict[str, Dict[str, float]]:
+        # Diagnostics by metric and transition name, for the metrics of AvailableFuncPerformanceMetric
+        diagnostics = {}
+        for metric, (measure, aggregation) in FUNCTION_METRICS.items():
+            diagnostics[metric] = {}
+            for tr in transitions:
+                if tr in self.transitions:
+                    value = getattr(self.transitions[tr][measure], aggregation)
+                    if value is not None:
+                        diagnostics[metric][tr] = value
+        return diagnostics
+
+    def object_diagnostics(self, object_types: Iterable[str]) -> Dict[str, Dict[str, float]]:
+        # Diagnostics by metric and object type, for the metrics of AvailableObjPerformanceMetric
+        diagnostics = {}
+        for metric, attribute in OBJECT_METRICS.items():
+            diagnostics[metric] = {}
+            for ot in object_types:
+                if ot in self.object_types:
+                    value = getattr(self.object_types[ot], attribute)
+                    if value is not None:
+                        diagnostics[metric][ot] = value
+        return diagnostics
+
+
+# Objects without events for 30 days are taken as finished
+DEFAULT_HORIZON = 30 * 24 * 3600.0
+
+
+def _seconds(timestamps: pd.Series) -> List[float]:
+    return [timestamp.timestamp() for timestamp in pd.to_datetime(timestamps)]
+
+
+class IncrementalDiagnostics(object):
+    # The events of the stream are added in the order of their timestamps. Events are deduplicated by the timestamp of
+    # the last event added, only the ids of the events at that timestamp are kept, so events later added to the stream
+    # with an earlier timestamp are not counted. Objects without events for the horizon are taken as finished, their
+    # times stay in the statistics of their object type but an event of such an object counts as a new object.
+    def __init__(self, horizon: float = DEFAULT_HORIZON):
+        self.horizon = horizon
+        self.events = 0
+        self._high_water = None
+        self._high_water_ids = set()
+        # Object type, first and last timestamp and total service time by object, in the order of the last timestamps
+        self._objects = {}
+        self._transitions = {}
+        self._object_types = {}
+
+    def update(self, log: pd.DataFrame) -> None:
+        # Adds the events of the succint log that were not added before, in the order of their timestamps
+        if len(log) == 0:
+            return
+        ends = _seconds(log["event_timestamp"])
+        if self._high_water is not None:
+            event_ids = log["event_id"].to_numpy()
+            new = [i for i in range(len(log)) if ends[i] > self._high_water or (
+                ends[i] == self._high_water and event_ids[i] not in self._high_water_ids)]
+            if len(new) == 0:
+                return
+            log, ends = log.iloc[new], [ends[i] for i in new]
+        starts = _seconds(log["event_start_timestamp"]) if "event_start_timestamp" in log.columns else ends
+        event_ids = log["event_id"].to_numpy()
+        activities = log["event_activity"].to_numpy()
+        object_types = [x for x in log.columns if not x.startswith("event_")]
+        cells = {ot: log[ot].to_numpy() for ot in object_types}
+
+        for i in sorted(range(len(log)), key=lambda i: ends[i]):
+            if ends[i] != self._high_water:
+                self._high_water = ends[i]
+                self._high_water_ids = set()
+            self._high_water_ids.add(event_ids[i])
+            self.events += 1
+            objects = list(dict.fromkeys(
+                (ot, oi) for ot in object_types for oi in cell_objects(cells[ot][i]) if not pd.isna(oi)))
+            previous = [self._objects[oi][2] for _, oi in objects if oi in self._objects]
+            waiting = max(0.0, starts[i] - max(previous)) if len(previous) > 0 else 0.0
+            service = ends[i] - starts[i]
+            statistics = self._transitions.setdefault(
+                activities[i], {measure: RunningStatistic() for measure in MEASURES})
+            statistics[WAITING].add(waiting)
+            statistics[SERVICE].add(service)
+            statistics[SOJOURN].add(waiting + service)
+
+            for ot, oi in objects:
+                # Moved to the end, the objects stay in the order of their last timestamps
+                state = self._objects.pop(oi, None)
+                if state is None:
+                    state = (ot, ends[i], ends[i], 0.0)
+                    self._object_types.setdefault(ot, ObjectTypeStatistic()).objects += 1
+                object_type, first, last, total_service = state
+                ot_statistic = self._object_types[object_type]
+                ot_statistic.update_throughput(last - first, ends[i] - first)
+                ot_statistic.update_service(total_service, total_service + service)
+                self._objects[oi] = (object_type, first, ends[i], total_service + service)
+        self._drop_finished()
+
+    def _drop_finished(self) -> None:
+        for oi in list(self._objects):
+            if self._objects[oi][2] >= self._high_water - self.horizon:
+                break
+            del self._objects[oi]
+
+    def snapshot(self) -> DiagnosticsSnapshot:
+        return DiagnosticsSnapshot(
+            events=self.events,
+            transitions={tr: {measure: replace(statistic) for measure, statistic in statistics.items()}
+                         for tr, statistics in self._transitions.items()},
+            object_types={ot: replace(statistic) for ot, statistic in self._object_types.items()})
@@ -3,7 +3,7 @@ from dataclasses import dataclass, field
 from ocpa.objects.oc_petri_net.obj import ObjectCentricPetriNet
 from ocpa.objects.oc_petri_net.obj import Marking
 # from dtween.digitaltwin.ocpn.objects.obj import Marking
-from typing import List, Dict, Any, Optional, Set, Tuple
+from typing import List, Dict, Any, FrozenSet, Optional, Set, Tuple
 from dtween.digitaltwin.digitaltwin.action_engine.obj import ActionEngine, Action
 from dtween.digitaltwin.digitaltwin.control.obj import Valve, WriteOperation, ActivityVariant
 
@@ -23,6 +23,133 @@ class Guard(object):
         return self.expression == guard.expression and self.transition == guard.transition and self.valves == guard.valves
 
 
+class IndexedMarking(Marking):
+    # Marking indexed by place, by object and by object type, the tokens of a place or of an object type are found
+    # without scanning the marking. As by Marking.add_token, every object is in at most one place.
+
+    def __init__(self, tokens=None):
+        # Objects by place, place by object and the places with tokens by object type
+        self._places = {}
+        self._objects = {}
+        self._types = {}
+        if tokens is not None:
+            self.add_tokens(tokens)
+
+    @property
+    def tokens(self) -> Set[Tuple[ObjectCentricPetriNet.Place, str]]:
+        # A new set, changes to it are not applied to the marking
+        return {(pl, oi) for pl, objects in self._places.items() for oi in objects}
+
+    @property
+    def places(self) -> List[ObjectCentricPetriNet.Place]:
+        # Places with at least one token
+        return list(self._places)
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __eq__(self, other):
+        return isinstance(other, Marking) and self.tokens == other.tokens
+
+    def __repr__(self):
+        return "IndexedMarking({} tokens in {} places)".format(len(self), len(self._places))
+
+    def add_token(self, pl, obj):
+        self.remove_object(obj)
+        self._places.setdefault(pl, set()).add(obj)
+        self._types.setdefault(pl.object_type, set()).add(pl)
+        self._objects[obj] = pl
+
+    def add_tokens(self, tokens):
+        for pl, obj in tokens:
+            self.add_token(pl, obj)
+
+    def remove_token(self, pl, obj):
+        if self._objects.get(obj) == pl:
+            self.remove_object(obj)
+
+    def remove_object(self, obj):
+        pl = self._objects.pop(obj, None)
+        if pl is None:
+            return
+        objects = self._places[pl]
+        objects.discard(obj)
+        if len(objects) == 0:
+            del self._places[pl]
+            places = self._types[pl.object_type]
+            places.discard(pl)
+            if len(places) == 0:
+                del self._types[pl.object_type]
+
+    def place_of(self, obj) -> Optional[ObjectCentricPetriNet.Place]:
+        return self._objects.get(obj)
+
+    def objects_in(self, pl: ObjectCentricPetriNet.Place) -> Set[str]:
+        return set(self._places.get(pl, ()))
+
+    def tokens_in_place(self, pl: ObjectCentricPetriNet.Place) -> Set[Tuple[ObjectCentricPetriNet.Place, str]]:
+        return {(pl, oi) for oi in self._places.get(pl, ())}
+
+    def tokens_of_type(self, object_type: str) -> Set[Tuple[ObjectCentricPetriNet.Place, str]]:
+        return {(pl, oi) for pl in self._types.get(object_type, ()) for oi in self._places[pl]}
+
+
+def pre_place_index(ocpn: ObjectCentricPetriNet) -> Dict[ObjectCentricPetriNet.Transition, FrozenSet[ObjectCentricPetriNet.Place]]:
+    # Places from which every transition of the net is reachable, in one pass over the net also if it has loops. The
+    # strongly connected components are found by Tarjan's algorithm along the reversed arcs, which finds a component
+    # after all components it is reached from. The places reaching a component are its own places and the places
+    # reaching the components with an arc into it, a component without places and a single such component shares the
+    # set of that component.
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    component_of = {}
+    reaching = []
+    for root in list(ocpn.transitions) + list(ocpn.places):
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(root.preset))]
+        while len(work) > 0:
+            node, predecessors = work[-1]
+            for pre in predecessors:
+                if pre not in index:
+                    index[pre] = low[pre] = len(index)
+                    stack.append(pre)
+                    on_stack.add(pre)
+                    work.append((pre, iter(pre.preset)))
+                    break
+                if pre in on_stack:
+                    low[node] = min(low[node], index[pre])
+            else:
+                work.pop()
+                if len(work) > 0:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] != index[node]:
+                    continue
+                members = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    members.append(member)
+                    if member is node:
+                        break
+                # Members of the component itself are not assigned yet
+                sources = set(component_of[pre] for member in members for pre in member.preset if pre in component_of)
+                places = set(member for member in members if isinstance(member, ObjectCentricPetriNet.Place))
+                if len(places) == 0 and len(sources) == 1:
+                    reaching.append(reaching[sources.pop()])
+                else:
+                    reaching.append(frozenset(places.union(*[reaching[c] for c in sources])))
+                for member in members:
+                    component_of[member] = len(reaching) - 1
+    return {tr: reaching[component_of[tr]] for tr in ocpn.transitions}
+
+
 class DigitalTwin(object):
     _ocpn: ObjectCentricPetriNet
     _valves: Set[Valve]
@@ -30,20 +157,22 @@ class DigitalTwin(object):
     _writes: Set[WriteOperation]
     _write_operations: Set[WriteOperation]
     _activity_variants: Set[ActivityVariant]
-    _marking: Marking
+    _marking: IndexedMarking
     _action_engine: ActionEngine
     _default_control: Tuple[Set[Valve], Set[WriteOperation]]
+    _pre_places: Optional[Dict[ObjectCentricPetriNet.Transition, FrozenSet[ObjectCentricPetriNet.Place]]]
 
-    def __init__(self, ocpn, valves=set(), guards=set(), writes=set(), write_operations=set(), activity_variants=set(), marking=Marking(), action_engine=ActionEngine(), default_control=None):
+    def __init__(self, ocpn, valves=set(), guards=set(), writes=set(), write_operations=set(), activity_variants=set(), marking=None, action_engine=None, default_control=None):
         self._ocpn = ocpn
         self._valves = valves
         self._guards = guards
         self._writes = writes
         self._write_operations = write_operations
         self._activity_variants = activity_variants
-        self._marking = marking
-        self._action_engine = action_engine
+        self._marking = marking if marking is not None else IndexedMarking()
+        self._action_engine = action_engine if action_engine is not None else ActionEngine()
         self._default_control = default_control
+        self._pre_places = None
     # _config: Dict[str, float] = field(default_factory=dict)
     # _omap: Dict[str, Any] = field(default_factory=dict)
 
@@ -56,6 +185,7 @@ class DigitalTwin(object):
     @ocpn.setter
     def ocpn(self, ocpn: ObjectCentricPetriNet) -> None:
         self._ocpn = ocpn
+        self._pre_places = None
 
     @property
     def valves(self) -> Set[Valve]:
@@ -110,7 +240,10 @@ class DigitalTwin(object):
     #     return list(set([pl.object_type for pl in self._ocpn.places]))
 
     @property
-    def marking(self):
+    def marking(self) -> IndexedMarking:
+        if not isinstance(self._marking, IndexedMarking):
+            # e.g. markings of the projection variants or of twins stored before markings were indexed
+            self._marking = IndexedMarking(self._marking.tokens)
         return self._marking
 
     @marking.setter
@@ -170,24 +303,14 @@ class DigitalTwin(object):
         return [write for write in self._writes if write.tr_name == tr_name]
 
     def get_tokens_in_place(self, p: ObjectCentricPetriNet.Place):
-        tokens_in_p = set()
-        for (pl, oi) in self._marking.tokens:
-            if pl == p:
-                tokens_in_p.add((pl, oi))
-        return tokens_in_p
-
-    def relate_pre_places(self, t):
-        results = {}
-        results["pre_places"] = set()
-        self._relate_pre_places(t, results)
-        return results["pre_places"]
-
-    def _relate_pre_places(self, t: ObjectCentricPetriNet.Transition, results: Dict[str, Set[ObjectCentricPetriNet.Place]]) -> None:
-        if len(t.preset) == 0:
-            return
-        for pl in t.preset:
-            results["pre_places"].add(pl)
-            for pre_tr in pl.preset:
-                tr_preset = pre_tr.preset
-                results["pre_places"].update(tr_preset)
-                self._relate_pre_places(pre_tr, results)
+        return self.marking.tokens_in_place(p)
+
+    def get_tokens_of_type(self, object_type: str):
+        return self.marking.tokens_of_type(object_type)
+
+    def relate_pre_places(self, t: ObjectCentricPetriNet.Transition) -> FrozenSet[ObjectCentricPetriNet.Place]:
+        # Places from which t is reachable. The index of the net is built on first use, twins stored before the index
+        # do not have the attribute.
+        if getattr(self, "_pre_places", None) is None:
+            self._pre_places = pre_place_index(self._ocpn)
+        return self._pre_places.get(t, frozenset())
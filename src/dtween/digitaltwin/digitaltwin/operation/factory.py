@@ -1,12 +1,14 @@
-from dtween.digitaltwin.digitaltwin.operation.versions import projection
+from dtween.digitaltwin.digitaltwin.operation.versions import projection, vectorized_projection
 
 import pandas as pd
 
 
 PROJECTION = "projection"
+VECTORIZED_PROJECTION = "vectorized_projection"
 
 VERSIONS = {
-    PROJECTION: projection.apply
+    PROJECTION: projection.apply,
+    VECTORIZED_PROJECTION: vectorized_projection.apply
 }
 
 
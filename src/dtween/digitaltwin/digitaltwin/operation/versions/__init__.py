@@ -1 +1,2 @@
 import dtween.digitaltwin.digitaltwin.operation.versions.projection
+import dtween.digitaltwin.digitaltwin.operation.versions.vectorized_projection
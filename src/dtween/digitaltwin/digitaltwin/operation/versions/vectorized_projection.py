@@ -0,0 +1,80 @@
+import weakref
+
+import numpy as np
+import pandas as pd
+from ocpa.objects.oc_petri_net.obj import Marking
+
+from dtween.digitaltwin.digitaltwin.objects.obj import IndexedMarking
+from dtween.digitaltwin.digitaltwin.util import cell_objects
+
+# Same marking as the projection variant without exploding the log row by row. The output places of the activities are
+# looked up once per OCPN, the objects of every object type column are exploded column-wise and only the last place
+# reached by every object is applied to the marking.
+
+_OUTPUT_PLACES = weakref.WeakKeyDictionary()
+
+
+def output_places(ocpn):
+    # Output place per object type of the transition of every activity, as found by the projection variant: the first
+    # transition of the activity and the last of its output places of the object type
+    if ocpn not in _OUTPUT_PLACES:
+        places = {}
+        for tr in ocpn.transitions:
+            if tr.name not in places:
+                places[tr.name] = {}
+                for arc in tr.out_arcs:
+                    places[tr.name][arc.target.object_type] = arc.target
+        _OUTPUT_PLACES[ocpn] = places
+    return _OUTPUT_PLACES[ocpn]
+
+
+def apply(ocpn, log, marking=None, parameters=None):
+    if parameters is None:
+        parameters = {}
+
+    if marking is None:
+        marking = Marking()
+
+    if len(log) == 0:
+        return marking
+
+    places = output_places(ocpn)
+    activities = log["event_activity"].to_numpy()
+
+    positions, ranks, targets, objects = [], [], [], []
+    # Object type columns in the order in which succint_mdl_to_exploded_mdl explodes them
+    object_types = [x for x in set(log.columns) if not x.startswith("event_")]
+    for rank, ot in enumerate(object_types):
+        ot_places = {act: pls[ot] for act, pls in places.items() if ot in pls}
+        if len(ot_places) == 0:
+            continue
+        target = pd.Series(activities).map(ot_places)
+        selected = target.notna().to_numpy()
+        exploded = pd.DataFrame({"position": np.flatnonzero(selected),
+                                 "place": target.to_numpy()[selected],
+                                 "object": [cell_objects(values) for values in log[ot].to_numpy()[selected]]}
+                                ).explode("object")
+        exploded = exploded[exploded["object"].notna()]
+        positions.append(exploded["position"].to_numpy(dtype=np.int64))
+        ranks.append(np.full(len(exploded), rank))
+        targets.append(exploded["place"].to_numpy())
+        objects.append(exploded["object"].to_numpy())
+
+    if len(positions) == 0:
+        return marking
+
+    # Stable, the objects of a cell keep their order
+    order = np.lexsort((np.concatenate(ranks), np.concatenate(positions)))
+    targets = np.concatenate(targets)[order]
+    objects = np.concatenate(objects)[order]
+    # Every token replaces the tokens of its object, only the last place of an object is kept
+    moved = dict(zip(objects, targets))
+
+    if isinstance(marking, IndexedMarking):
+        marking.add_tokens((pl, oi) for oi, pl in moved.items())
+    else:
+        tokens = marking.tokens
+        tokens.difference_update([(pl, oi) for (pl, oi) in tokens if oi in moved])
+        tokens.update((pl, oi) for oi, pl in moved.items())
+
+    return marking
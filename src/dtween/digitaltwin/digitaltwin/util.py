@@ -29,3 +29,14 @@ def update_config(directory, valve, value):
     with open(directory, 'w') as file:
         new_config['config'][valve] = value
         json.dump(new_config, file, indent=4)
+
+
+def cell_objects(values) -> list:
+    # Objects of a cell of an object type column of a succint log, as read by succint_mdl_to_exploded_mdl
+    if values is None:
+        return []
+    if type(values) is str and values[0] == "{":
+        values = eval(values)
+    if str(values).lower() == "nan" or str(values).lower() == "nat":
+        return []
+    return list(values)
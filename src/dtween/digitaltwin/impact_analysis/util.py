@@ -92,16 +92,17 @@ def compute_impacted_object_instances(dt: DigitalTwin, ai: ActionInstance):
     impacted_object_types = ai.impacted_objects
     impacted_object_instances = set()
     for ot in impacted_object_types:
-        for pl in dt.ocpn.places:
-            if pl.object_type == ot:
-                impacted_object_instances.update(dt.get_tokens_in_place(pl))
+        impacted_object_instances.update(dt.get_tokens_of_type(ot))
     return impacted_object_instances
 
 
 def compute_impacted_function_instances(dt: DigitalTwin, ai: ActionInstance):
     impacted_function_instances = set()
     impacted_functions = ai.impacted_functions
+    # Places reaching any of the functions, the tokens of a place shared by functions are looked up once
+    impacted_places = set()
     for tr in impacted_functions:
-        for pl in dt.relate_pre_places(tr):
-            impacted_function_instances.update(dt.get_tokens_in_place(pl))
+        impacted_places.update(dt.relate_pre_places(tr))
+    for pl in impacted_places:
+        impacted_function_instances.update(dt.get_tokens_in_place(pl))
     return impacted_function_instances
@@ -1,3 +1,5 @@
 import dtween.parsedata.config
 import dtween.parsedata.objects
 import dtween.parsedata.correlate
+import dtween.parsedata.batch
+import dtween.parsedata.importer
@@ -0,0 +1,95 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from dtween.available.available import AvailableCorrelations
+from dtween.parsedata.correlate import correlate_shared_objs, correlate_obj_path
+from dtween.parsedata.objects.columnar import META_FILE, save_columnar, load_columnar
+from dtween.parsedata.objects.ocdata import ObjectCentricData
+from dtween.parsedata.objects.oclog import Trace, ObjectCentricLog
+
+# Correlates several (method, selection) pairs of the same data in a process pool. The data is written once to a
+# columnar directory that every worker maps into memory, only the method and the selection are sent to the workers
+# and only the event ids of the traces are sent back. Every pair is correlated on the data as it is, i.e. the
+# results equal those of correlating each pair on its own copy of the data.
+
+CorrelationResult = Union[ObjectCentricLog, Dict[str, ObjectCentricLog]]
+# Trace id -> event ids, event id -> trace id
+LightweightResult = Tuple[Dict[int, List[str]], Dict[str, int]]
+
+
+@dataclass
+class CorrelationRequest:
+    method: AvailableCorrelations
+    selection: set
+
+
+@dataclass
+class CorrelationResponse:
+    # Position of the request in the batch, responses arrive in order of completion
+    index: int
+    request: CorrelationRequest
+    result: CorrelationResult
+
+
+# Data of the worker process, loaded once by the pool initializer
+_worker_data: Optional[ObjectCentricData] = None
+
+
+def init_worker(directory: str) -> None:
+    global _worker_data
+    _worker_data = load_columnar(directory, mmap_mode='r')
+
+
+def correlate(data: ObjectCentricData, method: AvailableCorrelations, selection: set,
+              read_only=False) -> CorrelationResult:
+    if method == AvailableCorrelations.OBJ_PATH_CORRELATION:
+        return correlate_obj_path(data, selection, read_only=read_only)
+    return correlate_shared_objs(data, selection, version=method, read_only=read_only)
+
+
+def to_lightweight(log: ObjectCentricLog) -> LightweightResult:
+    return ({tid: [str(event.id) for event in trace.events] for tid, trace in log.traces.items()},
+            {str(eid): tid for eid, tid in log.event_to_traces.items()})
+
+
+def from_lightweight(data: ObjectCentricData, result: LightweightResult) -> ObjectCentricLog:
+    traces, event_to_traces = result
+    events = data.raw.events
+    return ObjectCentricLog({tid: Trace(events=[events[eid] for eid in eids], id=tid) for tid, eids in traces.items()},
+                            event_to_traces, data.raw.objects, data.meta, data.vmap_param)
+
+
+def correlate_in_worker(method: AvailableCorrelations, selection: set):
+    result = correlate(_worker_data, method, selection, read_only=True)
+    if isinstance(result, ObjectCentricLog):
+        return to_lightweight(result)
+    return {key: to_lightweight(log) for key, log in result.items()}
+
+
+def correlate_batch(data: ObjectCentricData, requests: List[CorrelationRequest], max_workers: Optional[int] = None,
+                    directory: Optional[str] = None) -> Iterator[CorrelationResponse]:
+    # Yields the responses as soon as they are correlated. If directory is given, the columnar data is kept there,
+    # e.g. to reuse it for the next batch on the same data, otherwise it is removed after the last response
+    if len(requests) == 0:
+        return
+    with tempfile.TemporaryDirectory(prefix='dtween-batch-') as tmp:
+        if directory is None:
+            directory = tmp
+        if not os.path.exists(os.path.join(directory, META_FILE)):
+            save_columnar(data, directory)
+        max_workers = min(max_workers or os.cpu_count() or 1, len(requests))
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                 initargs=(directory,)) as executor:
+            futures = {executor.submit(correlate_in_worker, request.method, request.selection): index
+                       for index, request in enumerate(requests)}
+            for future in as_completed(futures):
+                index = futures[future]
+                result = future.result()
+                if isinstance(result, tuple):
+                    result = from_lightweight(data, result)
+                else:
+                    result = {key: from_lightweight(data, log) for key, log in result.items()}
+                yield CorrelationResponse(index, requests[index], result)
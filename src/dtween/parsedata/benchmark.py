@@ -0,0 +1,49 @@
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from dtween.parsedata.correlate import correlate_obj_path
+from dtween.parsedata.objects.ocdata import Event, Obj, MetaObjectCentricData, RawObjectCentricData, \
+    ObjectCentricData
+
+# Scaling of the object path correlation in the number of events and in the size of the selection.
+# Run with: python -m dtween.parsedata.benchmark
+
+EVENT_COUNTS = [1000, 10000, 50000]
+SELECTION_SIZES = [2, 3, 4, 5]
+
+
+def generate_data(n_events: int, obj_types: List[str], objs_per_event=3, seed=0) -> ObjectCentricData:
+    rand = random.Random(seed)
+    n_objects = max(n_events // objs_per_event, 1)
+    objects = {f'o{i}': Obj(id=f'o{i}', type=rand.choice(obj_types), ovmap={})
+               for i in range(n_objects)}
+    start = datetime(2021, 1, 1)
+    events = {}
+    for i in range(n_events):
+        omap = list({f'o{rand.randrange(n_objects)}' for _ in range(rand.randint(1, objs_per_event))})
+        events[f'e{i}'] = Event(id=f'e{i}', act=f'a{rand.randrange(10)}', time=start + timedelta(minutes=i),
+                                omap=omap, vmap={})
+    meta = MetaObjectCentricData(attr_names=[], attr_types=[], attr_typ={}, obj_types=obj_types, act_attr={})
+    return ObjectCentricData(meta, RawObjectCentricData(events, objects), None)
+
+
+def time_obj_path(n_events: int, selection_size: int) -> Tuple[float, int]:
+    obj_types = [f'ot{i}' for i in range(selection_size)]
+    data = generate_data(n_events, obj_types)
+    start = time.perf_counter()
+    logs = correlate_obj_path(data, set(obj_types))
+    return time.perf_counter() - start, len(logs)
+
+
+def run():
+    print(f'{"events":>10} {"selection":>10} {"orderings":>10} {"seconds":>10}')
+    for n_events in EVENT_COUNTS:
+        for selection_size in SELECTION_SIZES:
+            seconds, orderings = time_obj_path(n_events, selection_size)
+            print(f'{n_events:>10} {selection_size:>10} {orderings:>10} {seconds:>10.3f}')
+
+
+if __name__ == '__main__':
+    run()
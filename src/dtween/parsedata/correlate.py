@@ -1,5 +1,7 @@
+import bisect
+import heapq
 import itertools
-from typing import Dict
+from typing import Dict, List, Optional, Mapping, Sequence
 
 from dtween.available.available import AvailableCorrelations
 from dtween.parsedata.objects.ocdata import ObjectCentricData, Event
@@ -9,158 +11,167 @@ from dtween.parsedata.objects.oclog import Trace, ObjectCentricLog
 # TODO: P1 only outputs lightweight log with traces of EventIds
 # TODO: P3 remove code duplication
 # TODO: P2 create unit tests for this function
-# TODO: P1 get corr out of event and put it into a [bool] of size events (copy)
 # TODO: P4 check whether set is faster than list for the object map intersection test
-def correlate_obj_path(data: ObjectCentricData, selection: set) -> Dict[str, ObjectCentricLog]:
+def correlate_obj_path(data: ObjectCentricData, selection: set, read_only=False) -> Dict[str, ObjectCentricLog]:
     events = data.raw.events
     objects = data.raw.objects
-    logs = {}  # TODO: different
-    ordered_selections = itertools.permutations(selection)  # TODO: different
-    key_list = list(events.keys())
+    logs = {}
+    if len(events) == 0:
+        return logs
 
-    for ordered_selection in ordered_selections:  # TODO: different
+    # Built once and reused for every ordering of the selection
+    index = data.raw.obj_index
+    event_list = index.events
+    obj_events = index.obj_events
+    type_bits = {ot: 1 << i for i, ot in enumerate(selection)}
+    type_masks = [get_type_mask(event, objects, type_bits) for event in event_list]
+    # Visited state of this run, the orderings continue on the flags left by the previous ordering
+    flags = data.raw.corr_flags()
+
+    for ordered_selection in itertools.permutations(selection):
         tid = 0
         pos = 0
-        start_event = events[key_list[pos]]
-        corr = start_event.corr
-        all_correlated = False
+        corr = flags[pos]
         log = ObjectCentricLog({}, {}, objects, data.meta, data.vmap_param)
-        pos_selection = 0  # Current position on ordered selection # TODO: different
         event_to_trace = {}
 
-        while not all_correlated:
-
-            while True:
-                if len(events) - 1 == pos:  # finished
-                    all_correlated = True
-                    break
-                if start_event.corr is not corr:  # already correlated events are not correlated again
-                    pos += 1
-                    start_event = events[key_list[pos]]
-                elif len(get_obj_ids(start_event, objects,
-                                     {ordered_selection[
-                                         pos_selection]})) == 0:  # events with no matching object type are skipped
-                    start_event.corr = not corr  # Mark as "correlated"
-                    pos += 1
-                    start_event = events[key_list[pos]]
-                else:
-                    break
-            if all_correlated:
-                break
+        # The last event never starts a trace, it can only be correlated to an earlier one
+        while pos < len(event_list) - 1:
+            if flags[pos] != corr:  # already correlated events are not correlated again
+                pos += 1
+                continue
+            flags[pos] = 1 - corr  # Mark as "correlated"
+            # events with no matching object type are skipped
+            if not type_masks[pos] & type_bits[ordered_selection[0]]:
+                pos += 1
+                continue
+            start_event = event_list[pos]
             obj_ids = get_obj_ids(start_event, objects, selection)
             trace = Trace(events=[start_event],
                           id=tid)
             event_to_trace[start_event.id] = trace.id
             tid += 1
-            start_event.corr = not corr
-            # If the first event of a trace is the last in events, then we are done
-            if len(events) - 1 == pos:
-                log.traces[trace.id] = trace
-                all_correlated = True
-                break
-            pos += 1
-            pos_trace = pos
-            # We search the rest of events for more events correlated to the first event of the new trace
-            next_event = events[key_list[pos_trace]]
-            while True:
-                if next_event.corr is not corr:
-                    pass
+            next_pos = pos
+            for pos_selection in range(len(ordered_selection)):
                 # Correlated events share objects ids of the correct type
-                elif not set(next_event.omap).isdisjoint(obj_ids):
-                    trace.events.append(next_event)
-                    event_to_trace[next_event.id] = trace.id
-                    next_event.corr = not corr
-                    pos_selection += 1  # TODO different
-
-                    if pos_selection == len(ordered_selection):  # TODO different
-                        break  # TODO different
-                    # the current event's object id's for the correct type need to be shared by the next event
-                    obj_ids = get_obj_ids(next_event, objects, {
-                                          ordered_selection[pos_selection]})  # TODO different
-                if len(events) - 1 == pos_trace:  # All events were searched for that trac
+                next_pos = find_next_obj_event(
+                    flags, obj_events, obj_ids, next_pos, corr)
+                if next_pos is None:  # The path ends as soon as the type sequence is broken
+                    break
+                next_event = event_list[next_pos]
+                trace.events.append(next_event)
+                event_to_trace[next_event.id] = trace.id
+                flags[next_pos] = 1 - corr
+                if pos_selection + 1 == len(ordered_selection):
                     break
-                pos_trace += 1
-                next_event = events[key_list[pos_trace]]
+                # the current event's object id's for the correct type need to be shared by the next event
+                obj_ids = get_obj_ids(next_event, objects, {
+                                      ordered_selection[pos_selection + 1]})
             # Add trace to log and remove already correlated events
             log.traces[trace.id] = trace
             log.event_to_traces = event_to_trace
-            pos_selection = 0
+            # The event directly following the start event of a trace is never considered as a start event
+            pos += 2
         logs[str(ordered_selection)] = log
 
+    if not read_only:
+        data.raw.set_corr_flags(flags)
     return logs
 
 
+def find_next_obj_event(flags: bytearray, obj_events: Mapping[str, Sequence[int]],
+                        obj_ids: set, pos: int, corr: int) -> Optional[int]:
+    # First uncorrelated event after pos that shares one of obj_ids
+    next_pos = None
+    for obj in obj_ids:
+        positions = obj_events[obj]
+        i = bisect.bisect_right(positions, pos)
+        while i < len(positions) and (next_pos is None or positions[i] < next_pos):
+            if flags[positions[i]] == corr:
+                next_pos = positions[i]
+                break
+            i += 1
+    return next_pos
+
+
 # TODO: create unit tests for this function
 def correlate_shared_objs(data: ObjectCentricData,
                           selection: set,
-                          version=AvailableCorrelations.MAXIMUM_CORRELATION) -> ObjectCentricLog:
+                          version=AvailableCorrelations.MAXIMUM_CORRELATION,
+                          read_only=False) -> ObjectCentricLog:
     events = data.raw.events
     objects = data.raw.objects
     log = ObjectCentricLog({}, {}, objects, data.meta, data.vmap_param)
+    if len(events) == 0:
+        return log
 
+    index = data.raw.obj_index
+    event_list = index.events
+    obj_events = index.obj_events
+    # Visited state of this run, only copied back to the events if the data may be modified
+    flags = data.raw.corr_flags()
+    corr = flags[0]
     tid = 0
-    pos = 0
-    key_list = list(events.keys())
-    start_event = events[key_list[pos]]
-    corr = start_event.corr
-    all_correlated = False
     event_to_trace = {}
-    # Correlate while uncorrelated events exist
-    while not all_correlated:
-        # The first event with correct object is always the start event
-        # Assume events to be sorted according to total order
-        while True:
-            if len(events) - 1 == pos:  # finished
-                all_correlated = True
-                break
-            if start_event.corr is not corr:  # already correlated events are not correlated again
-                pos += 1
-                start_event = events[key_list[pos]]
-            elif len(get_obj_ids(start_event, objects,
-                                 selection)) == 0:  # events with no matching object type are skipped
-                start_event.corr = not corr  # Mark as "correlated"
-                pos += 1
-                start_event = events[key_list[pos]]
-            else:
-                break
-        if all_correlated:
-            break
+    # The first event with correct object is always the start event
+    # Assume events to be sorted according to total order
+    # The last event never starts a trace, it can only be correlated to an earlier one
+    for pos in range(len(event_list) - 1):
+        if flags[pos] != corr:  # already correlated events are not correlated again
+            continue
+        flags[pos] = 1 - corr  # Mark as "correlated"
+        start_event = event_list[pos]
         obj_ids = get_obj_ids(start_event, objects, selection)
+        if len(obj_ids) == 0:  # events with no matching object type are skipped
+            continue
         trace = Trace(events=[start_event],
                       id=tid)
         event_to_trace[start_event.id] = trace.id
         tid += 1
-        start_event.corr = not corr
-        if len(events) - 1 == pos:  # If the first event of a trace is the last in events, then we are done
-            log.traces[trace.id] = trace
-            all_correlated = True
-            break
-        #pos += 1
-        pos_trace = pos  # We search the rest of events for more events correlated to the first event of the new trace
-        next_event = events[key_list[pos_trace]]
-        while True:
-            if next_event.corr is not corr:  # Already correlated events cannot be correlated again
-                pass
-            elif not set(next_event.omap).isdisjoint(
-                    obj_ids):  # Correlated events share objects ids of the correct type
-                trace.events.append(next_event)
-                event_to_trace[next_event.id] = trace.id
-                next_event.corr = not corr
-                if version == AvailableCorrelations.MAXIMUM_CORRELATION:
-                    obj_ids.update({obj for obj in next_event.omap if
-                                    data.raw.objects[obj].type in selection})
-            if len(events) - 1 == pos_trace:
-                break
-            pos_trace += 1
-            next_event = events[key_list[pos_trace]]
+        # Instead of scanning all later events, only the later events of the trace's objects are visited in total order
+        candidates = []
+        for obj in obj_ids:
+            push_obj_events(candidates, obj_events, obj, pos)
+        while len(candidates) != 0:
+            next_pos, obj, i = heapq.heappop(candidates)
+            if i + 1 < len(obj_events[obj]):
+                heapq.heappush(candidates, (obj_events[obj][i + 1], obj, i + 1))
+            if flags[next_pos] != corr:  # Already correlated events cannot be correlated again
+                continue
+            next_event = event_list[next_pos]
+            trace.events.append(next_event)
+            event_to_trace[next_event.id] = trace.id
+            flags[next_pos] = 1 - corr
+            if version == AvailableCorrelations.MAXIMUM_CORRELATION:
+                # New objects only correlate events that come after the event introducing them
+                for obj in get_obj_ids(next_event, objects, selection):
+                    if obj not in obj_ids:
+                        obj_ids.add(obj)
+                        push_obj_events(candidates, obj_events, obj, next_pos)
 
         # Add trace to log and remove already correlated events
         log.traces[trace.id] = trace
     log.event_to_traces = event_to_trace
+    if not read_only:
+        data.raw.set_corr_flags(flags)
     return log
 
 
+def push_obj_events(candidates: list, obj_events: Mapping[str, Sequence[int]], obj: str, pos: int) -> None:
+    # Adds a cursor on the first event of obj after pos, the heap keeps the cursors in total order
+    i = bisect.bisect_right(obj_events[obj], pos)
+    if i < len(obj_events[obj]):
+        heapq.heappush(candidates, (obj_events[obj][i], obj, i))
+
+
 def get_obj_ids(event: Event, objects: dict, selection: set) -> set:
     return {obj for obj in event.omap if
             objects[obj].type in selection
             }
+
+
+def get_type_mask(event: Event, objects: dict, type_bits: Dict[str, int]) -> int:
+    mask = 0
+    for obj in event.omap:
+        mask |= type_bits.get(objects[obj].type, 0)
+    return mask
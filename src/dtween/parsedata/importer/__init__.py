@@ -0,0 +1 @@
+import dtween.parsedata.importer.ocel_json
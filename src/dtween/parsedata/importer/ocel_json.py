@@ -0,0 +1,166 @@
+import codecs
+import json
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, Dict, Iterator, Optional
+
+from ocpa.objects.log.importer.ocel.parameters import JsonParseParameters
+from ocpa.objects.log.obj import Event, Obj, ObjectCentricEventLog, MetaObjectCentricData, RawObjectCentricData
+
+# Incremental counterpart of ocpa's import_ocel_json.parse_json. The document is read in chunks and only one event or
+# object is decoded at a time, the members of ocel:events and ocel:objects go straight into the event and object
+# dicts. The resulting log equals the one of parse_json(json.load(stream)).
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = ' \t\n\r'
+
+# Called with the number of bytes read so far and the total number of bytes (None if unknown)
+Progress = Callable[[int, Optional[int]], None]
+
+
+class JsonStream:
+    # Reads a JSON document from a binary stream, the caller walks through the objects it is interested in and
+    # decodes the remaining values one at a time
+    def __init__(self, stream: BinaryIO, total: Optional[int] = None, progress: Optional[Progress] = None,
+                 chunk_size=CHUNK_SIZE):
+        self._stream = stream
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._chunk_size = chunk_size
+        self.total = total
+        self.read = 0
+        self._progress = progress
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._stream.read(self._chunk_size)
+        self.read += len(chunk)
+        self._eof = len(chunk) == 0
+        # Only the unread part of the buffer is kept
+        self._buffer = self._buffer[self._pos:] + self._decoder.decode(chunk, final=self._eof)
+        self._pos = 0
+        if self._progress is not None:
+            self._progress(self.read, self.total)
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f'Expected {char!r} but found {found!r} after {self.read} bytes')
+        self._pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def members(self) -> Iterator[str]:
+        # Yields the keys of the object at the current position, the caller consumes each value before the next key
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            separator = self.peek()
+            self._pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError(f'Expected \',\' or \'}}\' but found {separator!r} after {self.read} bytes')
+
+
+def stream_size(stream: BinaryIO) -> Optional[int]:
+    try:
+        return os.fstat(stream.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        pass
+    try:
+        return len(stream.getbuffer())
+    except AttributeError:
+        return None
+
+
+def parse_event(eid: str, item: Dict[str, Any], cfg: JsonParseParameters) -> Event:
+    vmap = item[cfg.event_params['vmap']]
+    time = datetime.fromisoformat(item[cfg.event_params['time']])
+    if 'start_timestamp' not in vmap:
+        vmap['start_timestamp'] = time
+    else:
+        vmap['start_timestamp'] = datetime.fromisoformat(vmap['start_timestamp'])
+    return Event(id=eid,
+                 act=item[cfg.event_params['act']],
+                 omap=item[cfg.event_params['omap']],
+                 vmap=vmap,
+                 time=time)
+
+
+def import_ocel_json(stream: BinaryIO, progress: Optional[Progress] = None,
+                     chunk_size=CHUNK_SIZE) -> ObjectCentricEventLog:
+    cfg = JsonParseParameters()
+    reader = JsonStream(stream, stream_size(stream), progress, chunk_size)
+    events = {}
+    objects = {}
+    log = {}
+    for key in reader.members():
+        if key == cfg.log_params['events']:
+            for eid in reader.members():
+                events[eid] = parse_event(eid, reader.value(), cfg)
+        elif key == cfg.log_params['objects']:
+            for oid in reader.members():
+                item = reader.value()
+                objects[oid] = Obj(id=oid,
+                                   type=item[cfg.obj_params['type']],
+                                   ovmap=item[cfg.obj_params['ovmap']])
+        else:
+            log[key] = reader.value()
+    events = OrderedDict(sorted(events.items(), key=lambda kv: kv[1].time))
+    return build_log(log[cfg.log_params['meta']], events, objects, cfg)
+
+
+def build_log(global_log: Dict[str, Any], events: Dict[str, Event], objects: Dict[str, Obj],
+              cfg: JsonParseParameters) -> ObjectCentricEventLog:
+    # Uses the last found value type
+    attr_events = {}
+    act_attr = {}
+    for event in events.values():
+        for v in event.vmap:
+            attr_events[v] = str(type(event.vmap[v]))
+        act_attr.setdefault(event.act, set()).update(event.vmap)
+    attr_objects = {}
+    for obj in objects.values():
+        for v in obj.ovmap:
+            attr_objects[v] = str(type(obj.ovmap[v]))
+    attr_types = list(set(attr_events.values()).union(attr_objects.values()))
+    meta = MetaObjectCentricData(attr_names=global_log[cfg.log_params['attr_names']],
+                                 obj_types=global_log[cfg.log_params['obj_types']],
+                                 attr_types=attr_types,
+                                 attr_typ={**attr_events, **attr_objects},
+                                 act_attr={act: list(attrs) for act, attrs in act_attr.items()},
+                                 attr_events=list(attr_events.keys()))
+    return ObjectCentricEventLog(meta, RawObjectCentricData(events, objects))
@@ -1,3 +1,6 @@
 import dtween.parsedata.objects.exporter
 import dtween.parsedata.objects.ocdata
 import dtween.parsedata.objects.oclog
+import dtween.parsedata.objects.columnar
+import dtween.parsedata.objects.timeindex
+import dtween.parsedata.objects.summary
@@ -0,0 +1,597 @@
+import os
+import pickle
+from array import array
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from dtween.parsedata.objects.ocdata import ObjectCentricData, ObjectEventIndex, RawObjectCentricData
+
+# Columnar backend of RawObjectCentricData. Instead of one Event/Obj dataclass per entry, events are kept in arrays:
+# interned activity codes, int64 timestamps (microseconds since the epoch) and a CSR incidence from events to
+# objects. The events and objects mappings keep the accessors of the dict based data (data.raw.events[eid].act, ...)
+# by handing out lightweight views that read from the arrays.
+
+EPOCH = datetime(1970, 1, 1)
+UNKNOWN_TYPE = -1
+# On disk, every array is one .npy file of a directory and the remaining python values are pickled to META_FILE. The
+# ids are also kept sorted, so that processes loading the directory look up ids in the mapped arrays instead of
+# building dicts of their own. String attributes of events and objects are dictionary-encoded: one code per event or
+# object indexes the strings of all attributes, which are kept as one utf-8 buffer with offsets. Only the attributes
+# of other values are pickled.
+ARRAY_FILES = ['event_ids', 'act_codes', 'times', 'obj_indptr', 'obj_indices', 'corr', 'obj_ids', 'type_codes',
+               'event_ids_sorted', 'event_ids_order', 'obj_ids_sorted', 'obj_ids_order', 'strings', 'string_offsets']
+META_FILE = 'meta.pickle'
+VMAP_FILE = 'vmap-{}-{}.npy'
+OVMAP_FILE = 'ovmap-{}-{}.npy'
+
+
+def to_epoch_us(time: datetime) -> int:
+    if time.tzinfo is not None:
+        time = time.astimezone(timezone.utc).replace(tzinfo=None)
+    return (time - EPOCH) // timedelta(microseconds=1)
+
+
+def from_epoch_us(us: int, utc: bool) -> datetime:
+    time = EPOCH + timedelta(microseconds=int(us))
+    if utc:
+        return time.replace(tzinfo=timezone.utc)
+    return time
+
+
+class SortedPositions(Mapping):
+    # Id -> position, looked up by binary search in the sorted ids
+    def __init__(self, sorted_ids: np.ndarray, order: np.ndarray):
+        self._sorted_ids = sorted_ids
+        self._order = order
+
+    def __getitem__(self, key) -> int:
+        i = int(np.searchsorted(self._sorted_ids, key))
+        if i == len(self._sorted_ids) or self._sorted_ids[i] != key:
+            raise KeyError(key)
+        return int(self._order[i])
+
+    def __iter__(self) -> Iterator[str]:
+        for i in np.argsort(self._order):
+            yield str(self._sorted_ids[i])
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+
+class StringTable:
+    # Strings of all dictionary-encoded attributes, the string with code i is data[offsets[i]:offsets[i + 1]]
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self._data = data
+        self._offsets = offsets
+
+    def __getitem__(self, code: int) -> str:
+        return bytes(self._data[self._offsets[code]:self._offsets[code + 1]]).decode('utf-8')
+
+
+class EncodedColumn:
+    # Column of a string attribute, indexed like the object arrays of the other attributes
+    def __init__(self, codes: np.ndarray, strings: StringTable):
+        self.codes = codes
+        self.strings = strings
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.strings[self.codes[key]]
+        return EncodedColumn(self.codes[key], self.strings)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+
+class AttributeRows(Sequence):
+    # The ovmaps of the objects read from one column per attribute
+    def __init__(self, columns: Dict[str, Any], present: Dict[str, np.ndarray], n: int):
+        self._columns = columns
+        self._present = present
+        self._n = n
+
+    def __getitem__(self, pos: int) -> Dict:
+        return {attr: column[pos] for attr, column in self._columns.items() if self._present[attr][pos]}
+
+    def __len__(self) -> int:
+        return self._n
+
+
+class ObjView:
+    __slots__ = ('_objects', '_pos')
+
+    def __init__(self, objects: 'ColumnarObjects', pos: int):
+        self._objects = objects
+        self._pos = pos
+
+    @property
+    def id(self) -> str:
+        return self._objects.ids[self._pos]
+
+    @property
+    def type(self) -> Optional[str]:
+        code = self._objects.type_codes[self._pos]
+        return self._objects.types[code] if code != UNKNOWN_TYPE else None
+
+    @property
+    def ovmap(self) -> Dict:
+        return self._objects.ovmaps[self._pos]
+
+    def __eq__(self, other):
+        return isinstance(other, ObjView) and self._objects is other._objects and self._pos == other._pos
+
+    def __hash__(self):
+        return hash((id(self._objects), self._pos))
+
+    def __repr__(self):
+        return f'ObjView(id={self.id!r}, type={self.type!r})'
+
+
+class ColumnarObjects(Mapping):
+    # Objects only referred to by events but never declared keep the type code UNKNOWN_TYPE and are no keys
+    ids: List[str]
+    type_codes: np.ndarray
+    types: List[str]
+    ovmaps: List[Dict]
+
+    def __init__(self, ids, type_codes, types, ovmaps, positions=None):
+        self.ids = ids
+        self.type_codes = type_codes
+        self.types = types
+        self.ovmaps = ovmaps
+        self.positions = positions if positions is not None else {oid: pos for pos, oid in enumerate(ids)}
+        self._n_known = int(np.count_nonzero(type_codes != UNKNOWN_TYPE))
+
+    def __getitem__(self, oid: str) -> ObjView:
+        pos = self.positions[oid]
+        if self.type_codes[pos] == UNKNOWN_TYPE:
+            raise KeyError(oid)
+        return ObjView(self, pos)
+
+    def __contains__(self, oid) -> bool:
+        pos = self.positions.get(oid)
+        return pos is not None and self.type_codes[pos] != UNKNOWN_TYPE
+
+    def __iter__(self) -> Iterator[str]:
+        for pos in np.flatnonzero(self.type_codes != UNKNOWN_TYPE):
+            yield self.ids[pos]
+
+    def __len__(self) -> int:
+        return self._n_known
+
+
+class EventView:
+    __slots__ = ('_events', '_pos')
+
+    def __init__(self, events: 'ColumnarEvents', pos: int):
+        self._events = events
+        self._pos = pos
+
+    @property
+    def id(self) -> str:
+        return self._events.ids[self._pos]
+
+    @property
+    def act(self) -> str:
+        return self._events.acts[self._events.act_codes[self._pos]]
+
+    @property
+    def time(self) -> datetime:
+        return from_epoch_us(self._events.times[self._pos], self._events.utc)
+
+    @property
+    def omap(self) -> List[str]:
+        return self._events.omap_at(self._pos)
+
+    @property
+    def vmap(self) -> Dict[str, Any]:
+        return self._events.vmap_at(self._pos)
+
+    @property
+    def corr(self) -> bool:
+        return self._events.corr[self._pos] == 1
+
+    @corr.setter
+    def corr(self, corr: bool) -> None:
+        self._events.corr[self._pos] = 1 if corr else 0
+
+    def __eq__(self, other):
+        return isinstance(other, EventView) and self._events is other._events and self._pos == other._pos
+
+    def __hash__(self):
+        return hash((id(self._events), self._pos))
+
+    def __repr__(self):
+        return f'EventView(id={self.id!r}, act={self.act!r}, time={self.time!r})'
+
+
+class EventSequence(Sequence):
+    # Positional access to the events in their total order, used by the correlation
+    def __init__(self, events: 'ColumnarEvents'):
+        self._events = events
+
+    def __getitem__(self, pos) -> EventView:
+        if isinstance(pos, slice):
+            return [EventView(self._events, i) for i in range(*pos.indices(len(self._events)))]
+        if pos < 0:
+            pos += len(self._events)
+        if not 0 <= pos < len(self._events):
+            raise IndexError(pos)
+        return EventView(self._events, int(pos))
+
+    def __iter__(self) -> Iterator[EventView]:
+        for pos in range(len(self._events)):
+            yield EventView(self._events, pos)
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+
+class ColumnarEvents(Mapping):
+    ids: List[str]
+    # Interned activities, act_codes[pos] indexes acts
+    act_codes: np.ndarray
+    acts: List[str]
+    # Microseconds since the epoch, in UTC if utc is set
+    times: np.ndarray
+    utc: bool
+    # CSR incidence, the objects of the event at pos are obj_indices[obj_indptr[pos]:obj_indptr[pos + 1]]
+    obj_indptr: np.ndarray
+    obj_indices: np.ndarray
+    objects: ColumnarObjects
+    # One column per value attribute, present marks the events that have the attribute in their vmap. Columns of
+    # loaded string attributes are EncodedColumns.
+    vmap_values: Dict[str, Any]
+    vmap_present: Dict[str, np.ndarray]
+    # Kept for backward compatibility with the evaluation, the columnar counterpart of Event.corr
+    corr: bytearray
+
+    def __init__(self, ids, act_codes, acts, times, utc, obj_indptr, obj_indices, objects, vmap_values,
+                 vmap_present, corr=None, positions=None):
+        self.ids = ids
+        self.act_codes = act_codes
+        self.acts = acts
+        self.times = times
+        self.utc = utc
+        self.obj_indptr = obj_indptr
+        self.obj_indices = obj_indices
+        self.objects = objects
+        self.vmap_values = vmap_values
+        self.vmap_present = vmap_present
+        self.corr = corr if corr is not None else bytearray(len(ids))
+        self._positions = positions
+
+    @property
+    def positions(self) -> Dict[str, int]:
+        # Only built when events are accessed by id
+        if self._positions is None:
+            self._positions = {eid: pos for pos, eid in enumerate(self.ids)}
+        return self._positions
+
+    @property
+    def by_position(self) -> EventSequence:
+        return EventSequence(self)
+
+    def __getitem__(self, eid: str) -> EventView:
+        return EventView(self, self.positions[eid])
+
+    def __contains__(self, eid) -> bool:
+        return eid in self.positions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def values(self):
+        return self.by_position
+
+    def omap_at(self, pos: int) -> List[str]:
+        obj_ids = self.objects.ids
+        return [obj_ids[i] for i in self.obj_indices[self.obj_indptr[pos]:self.obj_indptr[pos + 1]]]
+
+    def vmap_at(self, pos: int) -> Dict[str, Any]:
+        return {attr: self.vmap_values[attr][pos] for attr in self.vmap_values if self.vmap_present[attr][pos]}
+
+    def take(self, order: np.ndarray) -> 'ColumnarEvents':
+        # New events in the given order of positions, the objects are shared
+        counts = np.diff(self.obj_indptr)[order]
+        obj_indptr = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(counts, out=obj_indptr[1:])
+        starts = np.repeat(self.obj_indptr[:-1][order] - obj_indptr[:-1], counts)
+        obj_indices = self.obj_indices[starts + np.arange(obj_indptr[-1], dtype=np.int64)]
+        corr = bytearray(np.frombuffer(bytes(self.corr), dtype=np.uint8)[order].tobytes())
+        return ColumnarEvents(ids=[self.ids[pos] for pos in order],
+                              act_codes=self.act_codes[order],
+                              acts=self.acts,
+                              times=self.times[order],
+                              utc=self.utc,
+                              obj_indptr=obj_indptr,
+                              obj_indices=obj_indices,
+                              objects=self.objects,
+                              vmap_values={attr: values[order] for attr, values in self.vmap_values.items()},
+                              vmap_present={attr: present[order] for attr, present in self.vmap_present.items()},
+                              corr=corr)
+
+
+class ObjectPositions(Mapping):
+    # Object id -> ascending event positions, slices of one array grouped by object
+    def __init__(self, objects: ColumnarObjects, positions: np.ndarray, bounds: np.ndarray):
+        self._objects = objects
+        self._positions = positions
+        self._bounds = bounds
+
+    def __getitem__(self, oid: str) -> np.ndarray:
+        pos = self._objects.positions[oid]
+        return self._positions[self._bounds[pos]:self._bounds[pos + 1]]
+
+    def __iter__(self) -> Iterator[str]:
+        for pos in np.flatnonzero(np.diff(self._bounds)):
+            yield self._objects.ids[pos]
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(np.diff(self._bounds)))
+
+
+@dataclass
+class ColumnarRawObjectCentricData(RawObjectCentricData):
+    events: ColumnarEvents
+    objects: ColumnarObjects
+
+    def build_obj_index(self) -> ObjectEventIndex:
+        events = self.events
+        event_pos = np.repeat(np.arange(len(events), dtype=np.int64), np.diff(events.obj_indptr))
+        order = np.lexsort((event_pos, events.obj_indices))
+        obj_indices = events.obj_indices[order]
+        positions = event_pos[order]
+        # An object listed twice in the same event is indexed once
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = (obj_indices[1:] != obj_indices[:-1]) | (positions[1:] != positions[:-1])
+        obj_indices = obj_indices[keep]
+        positions = positions[keep]
+        bounds = np.searchsorted(obj_indices, np.arange(len(self.objects.ids) + 1))
+        return ObjectEventIndex(events.by_position, ObjectPositions(self.objects, positions, bounds))
+
+    def corr_flags(self) -> bytearray:
+        return bytearray(self.events.corr)
+
+    def set_corr_flags(self, flags: bytearray) -> None:
+        self.events.corr[:] = flags
+
+    def sort_by_time(self) -> None:
+        self.events = self.events.take(np.argsort(self.events.times, kind='stable'))
+        self._obj_index = None
+
+
+class ColumnarDataBuilder:
+    # Appends events and objects one by one without creating Event or Obj instances
+    def __init__(self):
+        self._event_ids = []
+        self._act_codes = array('i')
+        self._acts = {}
+        self._times = array('q')
+        self._utc = None
+        self._obj_indptr = array('q', [0])
+        self._obj_indices = array('i')
+        self._vmaps = {}
+        self._obj_ids = []
+        self._obj_positions = {}
+        self._obj_type_codes = array('i')
+        self._obj_types = {}
+        self._ovmaps = []
+
+    def obj_position(self, oid: str) -> int:
+        pos = self._obj_positions.get(oid)
+        if pos is None:
+            pos = len(self._obj_ids)
+            self._obj_positions[oid] = pos
+            self._obj_ids.append(oid)
+            self._obj_type_codes.append(UNKNOWN_TYPE)
+            self._ovmaps.append({})
+        return pos
+
+    def add_object(self, oid: str, typ: str, ovmap: Dict) -> None:
+        pos = self.obj_position(oid)
+        self._obj_type_codes[pos] = self._obj_types.setdefault(typ, len(self._obj_types))
+        self._ovmaps[pos] = ovmap
+
+    def add_event(self, eid: str, act: str, time: datetime, omap: List[str], vmap: Dict[str, Any]) -> None:
+        pos = len(self._event_ids)
+        self._event_ids.append(eid)
+        self._act_codes.append(self._acts.setdefault(act, len(self._acts)))
+        if self._utc is None:
+            self._utc = time.tzinfo is not None
+        self._times.append(to_epoch_us(time))
+        for oid in omap:
+            self._obj_indices.append(self.obj_position(oid))
+        self._obj_indptr.append(len(self._obj_indices))
+        for attr, value in vmap.items():
+            self._vmaps.setdefault(attr, {})[pos] = value
+
+    def build(self) -> ColumnarRawObjectCentricData:
+        n = len(self._event_ids)
+        vmap_values = {}
+        vmap_present = {}
+        for attr, values in self._vmaps.items():
+            vmap_values[attr] = np.empty(n, dtype=object)
+            vmap_present[attr] = np.zeros(n, dtype=bool)
+            for pos, value in values.items():
+                vmap_values[attr][pos] = value
+                vmap_present[attr][pos] = True
+        objects = ColumnarObjects(ids=self._obj_ids,
+                                  type_codes=np.array(self._obj_type_codes, dtype=np.int32),
+                                  types=list(self._obj_types),
+                                  ovmaps=self._ovmaps)
+        events = ColumnarEvents(ids=self._event_ids,
+                                act_codes=np.array(self._act_codes, dtype=np.int32),
+                                acts=list(self._acts),
+                                times=np.array(self._times, dtype=np.int64),
+                                utc=bool(self._utc),
+                                obj_indptr=np.array(self._obj_indptr, dtype=np.int64),
+                                obj_indices=np.array(self._obj_indices, dtype=np.int32),
+                                objects=objects,
+                                vmap_values=vmap_values,
+                                vmap_present=vmap_present)
+        return ColumnarRawObjectCentricData(events, objects)
+
+
+def to_columnar(data: ObjectCentricData) -> ObjectCentricData:
+    builder = ColumnarDataBuilder()
+    for oid, obj in data.raw.objects.items():
+        builder.add_object(oid, obj.type, obj.ovmap)
+    for eid, event in data.raw.events.items():
+        builder.add_event(eid, event.act, event.time, event.omap, event.vmap)
+    raw = builder.build()
+    raw.events.corr[:] = bytes(1 if event.corr else 0 for event in data.raw.events.values())
+    return ObjectCentricData(data.meta, raw, data.vmap_param)
+
+
+def sorted_ids(ids: np.ndarray):
+    order = np.argsort(ids, kind='stable')
+    return ids[order], order
+
+
+def attribute_columns(rows, n: int):
+    # Columns and present flags of the attributes of n dicts
+    columns = {}
+    present = {}
+    for pos in range(n):
+        for attr, value in rows[pos].items():
+            if attr not in columns:
+                columns[attr] = np.empty(n, dtype=object)
+                present[attr] = np.zeros(n, dtype=bool)
+            columns[attr][pos] = value
+            present[attr][pos] = True
+    return columns, present
+
+
+class StringEncoder:
+    def __init__(self):
+        self.codes = {}
+
+    def encode(self, column, present: np.ndarray) -> Optional[np.ndarray]:
+        # Codes of a column whose present values are all strings, otherwise None
+        positions = np.flatnonzero(present)
+        if not all(isinstance(column[pos], str) for pos in positions):
+            return None
+        codes = np.full(len(present), -1, dtype=np.int32)
+        for pos in positions:
+            codes[pos] = self.codes.setdefault(column[pos], len(self.codes))
+        return codes
+
+    def table(self):
+        encoded = [string.encode('utf-8') for string in self.codes]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def save_attributes(directory: str, file: str, columns, present, encoder: StringEncoder):
+    # Writes the codes of the string attributes and the present flags of all attributes, returns the attribute names
+    # and the columns of the other attributes, which are pickled
+    attrs = list(columns)
+    pickled = {}
+    for i, attr in enumerate(attrs):
+        np.save(os.path.join(directory, file.format(i, 'present')), present[attr])
+        codes = encoder.encode(columns[attr], present[attr])
+        if codes is None:
+            pickled[attr] = columns[attr]
+        else:
+            np.save(os.path.join(directory, file.format(i, 'codes')), codes)
+    return attrs, pickled
+
+
+def load_attributes(directory: str, file: str, attrs: List[str], pickled: Dict[str, np.ndarray],
+                    strings: StringTable, mmap_mode: Optional[str]):
+    columns = {}
+    present = {}
+    for i, attr in enumerate(attrs):
+        present[attr] = np.load(os.path.join(directory, file.format(i, 'present')), mmap_mode=mmap_mode)
+        if attr in pickled:
+            columns[attr] = pickled[attr]
+        else:
+            columns[attr] = EncodedColumn(np.load(os.path.join(directory, file.format(i, 'codes')),
+                                                  mmap_mode=mmap_mode), strings)
+    return columns, present
+
+
+def save_columnar(data: ObjectCentricData, directory: str) -> None:
+    if not isinstance(data.raw, ColumnarRawObjectCentricData):
+        data = to_columnar(data)
+    events = data.raw.events
+    objects = data.raw.objects
+    os.makedirs(directory, exist_ok=True)
+    encoder = StringEncoder()
+    vmaps, vmap_values = save_attributes(directory, VMAP_FILE, events.vmap_values, events.vmap_present, encoder)
+    ovmap_columns, ovmap_present = attribute_columns(objects.ovmaps, len(objects.ids))
+    ovmaps, ovmap_values = save_attributes(directory, OVMAP_FILE, ovmap_columns, ovmap_present, encoder)
+    strings, string_offsets = encoder.table()
+    event_ids = np.array(events.ids, dtype=str)
+    obj_ids = np.array(objects.ids, dtype=str)
+    event_ids_sorted, event_ids_order = sorted_ids(event_ids)
+    obj_ids_sorted, obj_ids_order = sorted_ids(obj_ids)
+    arrays = {'event_ids': event_ids,
+              'act_codes': events.act_codes,
+              'times': events.times,
+              'obj_indptr': events.obj_indptr,
+              'obj_indices': events.obj_indices,
+              'corr': np.frombuffer(bytes(events.corr), dtype=np.uint8),
+              'obj_ids': obj_ids,
+              'type_codes': objects.type_codes,
+              'event_ids_sorted': event_ids_sorted,
+              'event_ids_order': event_ids_order,
+              'obj_ids_sorted': obj_ids_sorted,
+              'obj_ids_order': obj_ids_order,
+              'strings': strings,
+              'string_offsets': string_offsets}
+    for name in ARRAY_FILES:
+        np.save(os.path.join(directory, name + '.npy'), arrays[name])
+    meta = {'acts': events.acts,
+            'utc': events.utc,
+            'types': objects.types,
+            'vmaps': vmaps,
+            'vmap_values': vmap_values,
+            'ovmaps': ovmaps,
+            'ovmap_values': ovmap_values,
+            'meta': data.meta,
+            'vmap_param': data.vmap_param}
+    with open(os.path.join(directory, META_FILE), 'wb') as f:
+        pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_columnar(directory: str, mmap_mode: Optional[str] = 'r') -> ObjectCentricData:
+    # With mmap_mode, the arrays are mapped instead of read so that processes loading the same directory share
+    # their pages
+    arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+              for name in ARRAY_FILES}
+    with open(os.path.join(directory, META_FILE), 'rb') as f:
+        meta = pickle.load(f)
+    strings = StringTable(arrays['strings'], arrays['string_offsets'])
+    vmap_values, vmap_present = load_attributes(directory, VMAP_FILE, meta['vmaps'], meta['vmap_values'], strings,
+                                                mmap_mode)
+    ovmap_columns, ovmap_present = load_attributes(directory, OVMAP_FILE, meta['ovmaps'], meta['ovmap_values'],
+                                                   strings, mmap_mode)
+    objects = ColumnarObjects(ids=arrays['obj_ids'],
+                              type_codes=arrays['type_codes'],
+                              types=meta['types'],
+                              ovmaps=AttributeRows(ovmap_columns, ovmap_present, len(arrays['obj_ids'])),
+                              positions=SortedPositions(arrays['obj_ids_sorted'], arrays['obj_ids_order']))
+    events = ColumnarEvents(ids=arrays['event_ids'],
+                            act_codes=arrays['act_codes'],
+                            acts=meta['acts'],
+                            times=arrays['times'],
+                            utc=meta['utc'],
+                            obj_indptr=arrays['obj_indptr'],
+                            obj_indices=arrays['obj_indices'],
+                            objects=objects,
+                            vmap_values=vmap_values,
+                            vmap_present=vmap_present,
+                            # The flags are written by the correlation and are copied out of the mapping
+                            corr=bytearray(arrays['corr']),
+                            positions=SortedPositions(arrays['event_ids_sorted'], arrays['event_ids_order']))
+    return ObjectCentricData(meta['meta'], ColumnarRawObjectCentricData(events, objects), meta['vmap_param'])
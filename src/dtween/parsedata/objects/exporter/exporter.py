@@ -72,8 +72,9 @@ def export_logs_to_dict(logs: Dict[str, ObjectCentricLog]) -> Dict[str,
 
 
 def export_oc_data_events_to_dataframe(events: Dict[str, Event], objects: Dict[str, Obj], rows=None) -> pd.DataFrame:
+    # Only the exported rows are accessed, so columnar events are not materialized beyond them
     export_dicts, cols = export_events(
-        objects, [events[eid] for eid in events], rows=rows)
+        objects, list(itertools.islice(events.values(), rows)), rows=rows)
     df = pd.DataFrame(export_dicts).T
     return df[cols]
 
@@ -1,5 +1,6 @@
+import threading
 from dataclasses import dataclass, field
-from typing import List, Dict, Set, Any, Optional, Union, Tuple
+from typing import List, Dict, Set, Any, Optional, Union, Tuple, Mapping, Sequence
 from datetime import datetime
 
 from dtween.available.available import AvailableSelections
@@ -58,15 +59,70 @@ class MetaObjectCentricData:
         self.acts = {act for act in self.act_attr}
 
 
+@dataclass
+class ObjectEventIndex:
+    # Events in their total order, positions below refer to this sequence
+    events: Sequence[Event]
+    # Object id -> ascending positions of the events referring to it
+    obj_events: Mapping[str, Sequence[int]]
+
+
+def build_obj_event_index(events: Dict[str, Event]) -> ObjectEventIndex:
+    event_list = list(events.values())
+    obj_events = {}
+    for pos, event in enumerate(event_list):
+        for oid in event.omap:
+            if oid not in obj_events:
+                obj_events[oid] = [pos]
+            elif obj_events[oid][-1] != pos:
+                obj_events[oid].append(pos)
+    return ObjectEventIndex(event_list, obj_events)
+
+
+# Correlations running in parallel threads on the same data build the index only once
+_obj_index_lock = threading.Lock()
+
+
 @dataclass
 class RawObjectCentricData:
     events: Dict[str, Event]
     objects: Dict[str, Obj]
+    _obj_index: Optional[ObjectEventIndex] = field(
+        default=None, init=False, repr=False, compare=False)
 
     @property
     def obj_ids(self) -> List[str]:
         return list(self.objects.keys())
 
+    @property
+    def obj_index(self) -> ObjectEventIndex:
+        # Built once and shared by all correlations on this data, data pickled before the index existed has no attribute
+        index = getattr(self, '_obj_index', None)
+        if index is None or len(index.events) != len(self.events):
+            with _obj_index_lock:
+                index = getattr(self, '_obj_index', None)
+                if index is None or len(index.events) != len(self.events):
+                    index = self.build_obj_index()
+                    self._obj_index = index
+        return index
+
+    def build_obj_index(self) -> ObjectEventIndex:
+        return build_obj_event_index(self.events)
+
+    def corr_flags(self) -> bytearray:
+        # Copy of the corr flags in the total order of the events, one byte per event
+        return bytearray(1 if event.corr else 0 for event in self.events.values())
+
+    def set_corr_flags(self, flags: bytearray) -> None:
+        for event, flag in zip(self.events.values(), flags):
+            event.corr = flag == 1
+
+    def sort_by_time(self) -> None:
+        self.events = {k: event for k, event in sorted(
+            self.events.items(), key=lambda item: item[1].time)}
+        # Positions of the index refer to the previous order
+        self._obj_index = None
+
 
 @dataclass
 class ObjectCentricData:
@@ -79,6 +135,4 @@ class ObjectCentricData:
 
 
 def sort_events(data: ObjectCentricData) -> None:
-    events = data.raw.events
-    data.raw.events = {k: event for k, event in sorted(
-        events.items(), key=lambda item: item[1].time)}
+    data.raw.sort_by_time()
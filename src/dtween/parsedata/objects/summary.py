@@ -0,0 +1,59 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from ocpa.objects.log.obj import ObjectCentricEventLog
+
+# Small summary of a parsed log, computed in one pass while parsing, so that pages showing e.g. the time bounds of a
+# log do not need to load or convert the whole log.
+
+
+@dataclass
+class ObjectTypeSummary:
+    objects: int = 0
+    # Events referring to at least one object of the type
+    events: int = 0
+    activities: Dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class LogSummary:
+    start: Optional[datetime]
+    end: Optional[datetime]
+    events: int
+    objects: int
+    activities: Dict[str, int]
+    object_types: Dict[str, ObjectTypeSummary]
+    attribute_names: List[str]
+
+
+def summarize_log(ocel: ObjectCentricEventLog) -> LogSummary:
+    start = None
+    end = None
+    activities = Counter()
+    type_events = Counter()
+    type_activities = {}
+    objects = ocel.raw.objects
+    for event in ocel.raw.events.values():
+        if start is None or event.time < start:
+            start = event.time
+        if end is None or event.time > end:
+            end = event.time
+        activities[event.act] += 1
+        # Objects only referred to by events but never declared have no type
+        for ot in {objects[oid].type for oid in event.omap if oid in objects}:
+            type_events[ot] += 1
+            type_activities.setdefault(ot, Counter())[event.act] += 1
+    type_objects = Counter(obj.type for obj in objects.values())
+    object_types = {ot: ObjectTypeSummary(objects=type_objects[ot],
+                                          events=type_events[ot],
+                                          activities=dict(type_activities.get(ot, {})))
+                    for ot in sorted(set(type_objects) | set(type_events))}
+    return LogSummary(start=start,
+                      end=end,
+                      events=len(ocel.raw.events),
+                      objects=len(objects),
+                      activities=dict(activities),
+                      object_types=object_types,
+                      attribute_names=list(ocel.meta.attr_names))
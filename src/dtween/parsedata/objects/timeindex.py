@@ -0,0 +1,93 @@
+import copy
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List
+
+import numpy as np
+from ocpa.objects.log.obj import ObjectCentricEventLog, RawObjectCentricData
+
+from dtween.parsedata.objects.columnar import to_epoch_us
+
+# Time index over a parsed log. Events are sorted by their timestamp, so that the events of a time window are a slice
+# found by two binary searches. In object windows, a window holds the whole lifecycles of the objects with an event in
+# the window, e.g. to analyze the objects active in a period with their complete flow times.
+
+EVENT_WINDOW = 'event'
+OBJECT_WINDOW = 'object'
+
+
+@dataclass
+class TimeIndex:
+    # Event ids in ascending order of their timestamps, microseconds since the epoch
+    event_ids: List[str]
+    times: np.ndarray
+    # CSR incidence from the objects to the positions of their events in the order above
+    obj_ids: List[str]
+    obj_indptr: np.ndarray
+    obj_positions: np.ndarray
+
+    def __len__(self):
+        return len(self.event_ids)
+
+    def bounds(self, start: datetime, end: datetime):
+        # Positions of the events in [start, end)
+        return (int(np.searchsorted(self.times, to_epoch_us(start), side='left')),
+                int(np.searchsorted(self.times, to_epoch_us(end), side='left')))
+
+    def covers(self, start: datetime, end: datetime) -> bool:
+        return self.bounds(start, end) == (0, len(self))
+
+    def window_positions(self, start: datetime, end: datetime, mode=EVENT_WINDOW) -> np.ndarray:
+        lo, hi = self.bounds(start, end)
+        if mode == EVENT_WINDOW:
+            return np.arange(lo, hi)
+        if mode != OBJECT_WINDOW:
+            raise ValueError(f'Unknown window mode {mode}')
+        # Objects of the events in the window, with all their events
+        in_window = np.zeros(len(self), dtype=bool)
+        in_window[lo:hi] = True
+        counts = np.diff(self.obj_indptr)
+        obj_of_position = np.repeat(np.arange(len(self.obj_ids)), counts)
+        active = np.zeros(len(self.obj_ids), dtype=bool)
+        active[obj_of_position[in_window[self.obj_positions]]] = True
+        positions = self.obj_positions[active[obj_of_position]]
+        # Events without objects are kept if they are in the window
+        return np.union1d(positions, np.arange(lo, hi))
+
+
+def build_time_index(ocel: ObjectCentricEventLog) -> TimeIndex:
+    event_ids = list(ocel.raw.events.keys())
+    times = np.fromiter((to_epoch_us(event.time) for event in ocel.raw.events.values()),
+                        dtype=np.int64, count=len(event_ids))
+    # Stable, events of the same timestamp keep the order of the log
+    order = np.argsort(times, kind='stable')
+    event_ids = [event_ids[pos] for pos in order]
+    obj_events = {}
+    for pos, eid in enumerate(event_ids):
+        for oid in ocel.raw.events[eid].omap:
+            obj_events.setdefault(oid, []).append(pos)
+    obj_ids = list(obj_events.keys())
+    obj_indptr = np.zeros(len(obj_ids) + 1, dtype=np.int64)
+    obj_indptr[1:] = np.cumsum([len(obj_events[oid]) for oid in obj_ids])
+    obj_positions = np.fromiter((pos for oid in obj_ids for pos in obj_events[oid]),
+                                dtype=np.int64, count=int(obj_indptr[-1]))
+    return TimeIndex(event_ids, times[order], obj_ids, obj_indptr, obj_positions)
+
+
+def window_log(ocel: ObjectCentricEventLog, index: TimeIndex, start: datetime, end: datetime,
+               mode=EVENT_WINDOW) -> ObjectCentricEventLog:
+    # Log of the events of the window, the events and objects are shared with the given log
+    events = OrderedDict()
+    for pos in index.window_positions(start, end, mode):
+        eid = index.event_ids[pos]
+        events[eid] = ocel.raw.events[eid]
+    objects = {oid: ocel.raw.objects[oid]
+               for oid in {oid for event in events.values() for oid in event.omap}
+               if oid in ocel.raw.objects}
+    window = ObjectCentricEventLog(copy.copy(ocel.meta), RawObjectCentricData(events, objects))
+    # Attributes set on the parsed log, e.g. vmap_param
+    for key, value in vars(ocel).items():
+        if key not in ('meta', 'raw'):
+            setattr(window, key, value)
+    return window